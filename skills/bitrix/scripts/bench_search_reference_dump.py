@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+"""Benchmark search_reference_dump.py on a synthetic Bitrix docs dump."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Windows: runs are timed by wall clock only, without peak RSS.
+    resource = None
+
+
+SEARCH_SCRIPT = Path(__file__).resolve().parent / "search_reference_dump.py"
+
+MODULES = ["crm", "iblock", "main", "tasks", "disk", "user", "sale", "catalog", "im", "rest"]
+API_NAMES = [
+    "CIBlockElement::GetList",
+    "CIBlockSection::GetList",
+    "Bitrix\\Main\\Loader::includeModule",
+    "Bitrix\\Main\\Application::getConnection",
+    "HighloadBlockTable::compileEntity",
+    "crm.deal.list",
+    "crm.deal.add",
+    "crm.item.list",
+    "tasks.task.list",
+    "disk.folder.getchildren",
+    "event.offline.get",
+    "user.get",
+    "UF_CRM_NAME",
+    "$this->getEntityTypeId()",
+]
+WORDS = (
+    "method returns list of items filter select order start batch limit field value entity "
+    "module event handler agent option request response error access rights user group "
+    "element section property iblock highload block table query cache index page result "
+    "record update delete create permission scope token application portal webhook site "
+    "template component parameter settings workflow task deal lead contact company invoice "
+    "сделка список элементов поле значение ошибка доступ пользователь модуль событие"
+).split()
+# Fixed query mix: frequent and rare words, identifiers, phrases and proximity.
+QUERIES = [
+    "crm.deal.list",
+    "CIBlockElement::GetList",
+    "GetList",
+    "includeModule",
+    '"batch limit"',
+    '"filter select order"',
+    "event NEAR/5 handler",
+    "deal NEAR/3 field",
+    "highload block entity",
+    "permission scope token",
+    "webhook",
+    "UF_CRM_NAME",
+    "сделка список",
+    "workflow template component parameter settings",
+    "start",
+    "tasks.task.list error",
+]
+
+
+@dataclass
+class Corpus:
+    root: Path
+    docs: int = 0
+    files: int = 0
+    bytes: int = 0
+    formats: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class Measured:
+    seconds: float
+    peak_rss_mb: float | None
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Generate a synthetic Bitrix docs dump (JSON, JSONL, md/txt) and measure "
+            "search_reference_dump.py index build, query latency, peak RSS and throughput."
+        )
+    )
+    parser.add_argument(
+        "--docs",
+        type=int,
+        default=3000,
+        help="Number of synthetic documents. Default: 3000",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+        help="Random seed for the generator. Default: 1",
+    )
+    parser.add_argument(
+        "--out",
+        default=None,
+        help="Keep the generated dump and index in this directory. Default: temporary, removed.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Passed to search_reference_dump.py --workers for build and scan. Default: 1",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Repetitions of each query against the index (via --serve). Default: 5",
+    )
+    parser.add_argument(
+        "--scan-runs",
+        type=int,
+        default=1,
+        help="Repetitions of each query as a raw --scan process (0 = skip). Default: 1",
+    )
+    parser.add_argument(
+        "--json-out",
+        default=None,
+        help="Write metrics as JSON to this path (use as a later --baseline).",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Metrics JSON from a previous run; exit 1 when a metric regresses past --tolerance.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative slowdown/growth against --baseline. Default: 0.25",
+    )
+    parser.add_argument(
+        "--script",
+        default=str(SEARCH_SCRIPT),
+        help="search_reference_dump.py to benchmark. Default: the sibling script.",
+    )
+    return parser.parse_args()
+
+
+def zipf_weights(size: int) -> list[float]:
+    return [1.0 / rank for rank in range(1, size + 1)]
+
+
+def make_text(rng: random.Random, vocabulary: list[str], weights: list[float]) -> str:
+    sentences = []
+    for _ in range(rng.randint(4, 24)):
+        words = rng.choices(vocabulary, weights=weights, k=rng.randint(6, 18))
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), rng.choice(API_NAMES))
+        sentence = " ".join(words)
+        sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+    return " ".join(sentences)
+
+
+def generate_corpus(root: Path, docs: int, seed: int) -> Corpus:
+    rng = random.Random(seed)
+    # Frequent real words first, then a long tail of rare synthetic terms.
+    vocabulary = WORDS + [f"term{index}" for index in range(2000)]
+    weights = zipf_weights(len(vocabulary))
+    corpus = Corpus(root=root)
+    root.mkdir(parents=True, exist_ok=True)
+
+    json_docs = docs * 3 // 10
+    jsonl_docs = docs * 4 // 10
+    tree_docs = docs - json_docs - jsonl_docs
+
+    # Dict-of-content JSON: {"<doc-path>": {"title": ..., "content": ...}}
+    helpdesk = {}
+    for index in range(json_docs):
+        module = rng.choice(MODULES)
+        helpdesk[f"docs/{module}/page{index}.md"] = {
+            "title": f"{module} {rng.choice(WORDS)} {rng.choice(API_NAMES)}",
+            "content": make_text(rng, vocabulary, weights),
+        }
+    write_file(corpus, root / "helpdesk.json", json.dumps(helpdesk, ensure_ascii=False), "json")
+    corpus.docs += json_docs
+
+    # Raw UTF-8 JSONL, and JSONL with json.dumps() defaults (non-ASCII as \uXXXX escapes).
+    for name, ensure_ascii, count in (
+        ("rest.jsonl", False, jsonl_docs - jsonl_docs // 2),
+        ("events.jsonl", True, jsonl_docs // 2),
+    ):
+        lines = []
+        for index in range(count):
+            method = rng.choice(API_NAMES)
+            item = {"title": method, "content": make_text(rng, vocabulary, weights), "id": index}
+            lines.append(json.dumps(item, ensure_ascii=ensure_ascii))
+        write_file(corpus, root / name, "\n".join(lines) + "\n", "jsonl")
+    corpus.docs += jsonl_docs
+
+    for index in range(tree_docs):
+        module = rng.choice(MODULES)
+        text = make_text(rng, vocabulary, weights)
+        if index % 5 == 4:
+            path = root / "kb" / module / f"note{index}.txt"
+            write_file(corpus, path, text + "\n", "txt")
+        else:
+            path = root / "kb" / module / f"page{index}.md"
+            write_file(corpus, path, f"# {rng.choice(API_NAMES)}\n\n{text}\n", "md")
+    corpus.docs += tree_docs
+    return corpus
+
+
+def write_file(corpus: Corpus, path: Path, text: str, kind: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = text.encode("utf-8")
+    path.write_bytes(data)
+    corpus.files += 1
+    corpus.bytes += len(data)
+    corpus.formats[kind] = corpus.formats.get(kind, 0) + 1
+
+
+def rss_mb(usage: resource.struct_rusage) -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss / divisor
+
+
+def round_rss(value: float | None) -> float | None:
+    return None if value is None else round(value, 1)
+
+
+def wait_measured(process: subprocess.Popen) -> float | None:
+    # wait4 gives the peak RSS of this child alone (RUSAGE_CHILDREN only keeps a running max).
+    # Without it (Windows) the process is just waited for and its RSS is unknown.
+    if resource is None or not hasattr(os, "wait4"):
+        process.wait()
+        return None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rss_mb(usage)
+
+
+def run_measured(command: list[str]) -> Measured:
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=out, stderr=err)
+        peak_rss_mb = wait_measured(process)
+        seconds = time.perf_counter() - started
+        out.seek(0)
+        err.seek(0)
+        return Measured(
+            seconds=seconds,
+            peak_rss_mb=peak_rss_mb,
+            returncode=process.returncode,
+            stdout=out.read().decode("utf-8", errors="replace"),
+            stderr=err.read().decode("utf-8", errors="replace"),
+        )
+
+
+def measure_server(script: str, root: Path, runs: int) -> tuple[list[float], float | None]:
+    # Round-trip latency per query against one --serve process holding the index.
+    command = [sys.executable, script, "--root", str(root), "--serve"]
+    latencies: list[float] = []
+    with tempfile.TemporaryFile() as err:
+        process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=err, text=True
+        )
+        for _ in range(runs):
+            for query in QUERIES:
+                started = time.perf_counter()
+                process.stdin.write(json.dumps({"query": query, "limit": 10}) + "\n")
+                process.stdin.flush()
+                response = json.loads(process.stdout.readline() or "{}")
+                latencies.append((time.perf_counter() - started) * 1000)
+                if "results" not in response:
+                    raise SystemExit(f"Server failed on {query!r}: {response}")
+        process.stdin.close()
+        peak_rss_mb = wait_measured(process)
+    return latencies, peak_rss_mb
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+def run_benchmark(args: argparse.Namespace, work_dir: Path) -> dict:
+    root = work_dir / "dump"
+    if root.exists():
+        shutil.rmtree(root)
+    corpus = generate_corpus(root, args.docs, args.seed)
+    megabytes = corpus.bytes / (1024 * 1024)
+    metrics: dict = {
+        "corpus": {
+            "docs": corpus.docs,
+            "files": corpus.files,
+            "mb": round(megabytes, 3),
+            "formats": corpus.formats,
+        }
+    }
+
+    build = run_measured(
+        [
+            sys.executable,
+            args.script,
+            "--root",
+            str(root),
+            "--build-index",
+            "--workers",
+            str(args.workers),
+        ]
+    )
+    if build.returncode != 0:
+        raise SystemExit(f"Index build failed:\n{build.stderr}")
+    metrics["build"] = {
+        "seconds": round(build.seconds, 3),
+        "docs_per_s": round(corpus.docs / build.seconds, 1),
+        "mb_per_s": round(megabytes / build.seconds, 3),
+        "peak_rss_mb": round_rss(build.peak_rss_mb),
+    }
+
+    latencies, server_rss = measure_server(args.script, root, max(args.runs, 1))
+    metrics["index_query"] = {**latency_summary(latencies), "peak_rss_mb": round_rss(server_rss)}
+
+    if args.scan_runs > 0:
+        for key, extra_args in (("scan_query", []), ("mmap_scan_query", ["--mmap"])):
+            scan_latencies: list[float] = []
+            scan_rss: float | None = None
+            for _ in range(args.scan_runs):
+                for query in QUERIES:
+                    scan = run_measured(
+                        [
+                            *scan_command(args, root),
+                            *extra_args,
+                            "--cache-size",
+                            "0",
+                            "--query",
+                            query,
+                        ]
+                    )
+                    if scan.returncode != 0:
+                        raise SystemExit(f"Scan failed on {query!r}:\n{scan.stderr}")
+                    scan_latencies.append(scan.seconds * 1000)
+                    if scan.peak_rss_mb is not None:
+                        scan_rss = max(scan_rss or 0.0, scan.peak_rss_mb)
+            median_seconds = percentile(scan_latencies, 50) / 1000
+            metrics[key] = {
+                **latency_summary(scan_latencies),
+                "docs_per_s": round(corpus.docs / median_seconds, 1),
+                "peak_rss_mb": round_rss(scan_rss),
+            }
+        metrics["mmap_hit_mismatches"] = compare_mmap_hits(args, root, corpus.docs)
+    return metrics
+
+
+def scan_command(args: argparse.Namespace, root: Path) -> list[str]:
+    return [
+        sys.executable,
+        args.script,
+        "--root",
+        str(root),
+        "--scan",
+        "--workers",
+        str(args.workers),
+    ]
+
+
+def compare_mmap_hits(args: argparse.Namespace, root: Path, docs: int) -> list[str]:
+    # --mmap only prefilters bytes, so every query must match the same documents as a plain scan.
+    # Queries run one at a time: in a --queries-file batch, other queries' terms would make the
+    # prefilter decode most lines anyway and hide a term the byte pattern misses.
+    mismatches = []
+    for query in QUERIES:
+        hits: list[set[str]] = []
+        for extra_args in ([], ["--mmap"]):
+            scan = run_measured(
+                [
+                    *scan_command(args, root),
+                    *extra_args,
+                    "--cache-size",
+                    "0",
+                    "--limit",
+                    str(docs),
+                    "--format",
+                    "jsonl",
+                    "--query",
+                    query,
+                ]
+            )
+            if scan.returncode != 0:
+                raise SystemExit(f"Scan failed on {query!r}:\n{scan.stderr}")
+            hits.append(
+                {json.loads(line)["source"] for line in scan.stdout.splitlines() if line.strip()}
+            )
+        plain, mapped = hits
+        if plain != mapped:
+            mismatches.append(f"{query!r}: scan {len(plain)} hits, --mmap {len(mapped)}")
+    return mismatches
+
+
+def format_rss(value: float | None) -> str:
+    return "peak RSS n/a" if value is None else f"peak RSS {value} MB"
+
+
+def print_metrics(metrics: dict) -> None:
+    corpus = metrics["corpus"]
+    formats = ", ".join(f"{kind} {count}" for kind, count in sorted(corpus["formats"].items()))
+    print(f"Corpus: {corpus['docs']} docs in {corpus['files']} files ({formats}), {corpus['mb']} MB")
+    build = metrics["build"]
+    print(
+        f"Index build: {build['seconds']:.3f}s, {build['docs_per_s']} docs/s, "
+        f"{build['mb_per_s']} MB/s, {format_rss(build['peak_rss_mb'])}"
+    )
+    labels = (
+        ("index_query", "Index query (--serve)"),
+        ("scan_query", "Raw scan query"),
+        ("mmap_scan_query", "Raw --mmap scan query"),
+    )
+    for key, label in labels:
+        if key not in metrics:
+            continue
+        row = metrics[key]
+        extra = f", {row['docs_per_s']} docs/s" if "docs_per_s" in row else ""
+        print(
+            f"{label}: {row['count']} runs, p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, "
+            f"p99 {row['p99_ms']} ms, {format_rss(row['peak_rss_mb'])}{extra}"
+        )
+
+
+def compare_baseline(metrics: dict, baseline: dict, tolerance: float) -> list[str]:
+    # Lower is better for every compared metric.
+    checks = [
+        ("build", "seconds"),
+        ("build", "peak_rss_mb"),
+        ("index_query", "p95_ms"),
+        ("index_query", "peak_rss_mb"),
+        ("scan_query", "p95_ms"),
+        ("scan_query", "peak_rss_mb"),
+        ("mmap_scan_query", "p95_ms"),
+        ("mmap_scan_query", "peak_rss_mb"),
+    ]
+    regressions = []
+    for section, name in checks:
+        old = baseline.get(section, {}).get(name)
+        new = metrics.get(section, {}).get(name)
+        if not old or new is None:
+            continue
+        if new > old * (1 + tolerance):
+            regressions.append(f"{section}.{name}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    if args.docs <= 0:
+        raise SystemExit("--docs must be positive.")
+    if not Path(args.script).is_file():
+        raise SystemExit(f"Search script not found: {args.script}")
+
+    if args.out:
+        work_dir = Path(args.out).expanduser().resolve()
+        work_dir.mkdir(parents=True, exist_ok=True)
+        metrics = run_benchmark(args, work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="bench-search-") as temp_dir:
+            metrics = run_benchmark(args, Path(temp_dir))
+
+    print_metrics(metrics)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(metrics, indent=2) + "\n", encoding="utf-8")
+
+    mismatches = metrics.get("mmap_hit_mismatches", [])
+    if mismatches:
+        print("--mmap scan hits differ from the plain scan:")
+        for line in mismatches:
+            print(f"  {line}")
+        return 1
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare_baseline(metrics, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
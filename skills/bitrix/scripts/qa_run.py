@@ -4,15 +4,25 @@
 from __future__ import annotations
 
 import argparse
+import heapq
 import os
 import re
 import shlex
 import shutil
+import signal
+import sqlite3
+import statistics
 import subprocess
-from dataclasses import dataclass
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import IO, Callable, Deque, Dict, List, Optional, Tuple
+from xml.etree import ElementTree
 
 
 STATUS_PASS = "PASS"
@@ -23,6 +33,132 @@ RISK_LOW = "low"
 RISK_MED = "med"
 RISK_HIGH = "high"
 
+CASE_PASSED = "passed"
+CASE_FAILED = "failed"
+CASE_ERROR = "error"
+CASE_SKIPPED = "skipped"
+CASE_MESSAGE_CHARS = 500
+REPORT_FAILED_CASES = 50
+
+# Timing history: one SQLite file with step and per-test durations of the last runs.
+HISTORY_DIR = Path("tests") / ".qa-history"
+HISTORY_FILE_NAME = "timings.sqlite"
+HISTORY_KEEP_RUNS = 50
+HISTORY_REPORT_ROWS = 15
+# A test needs this many earlier passing runs, and must take at least this long now, before it
+# can be reported as slower than its rolling median.
+REGRESSION_MIN_SAMPLES = 3
+REGRESSION_MIN_SEC = 0.05
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    module_id TEXT NOT NULL,
+    overall TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration_sec REAL NOT NULL,
+    executed INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS tests (
+    run_id INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration_sec REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_by_class ON tests (step, class_name, run_id);
+CREATE INDEX IF NOT EXISTS tests_by_run ON tests (run_id);
+CREATE INDEX IF NOT EXISTS runs_by_module ON runs (module_id, id);
+"""
+
+# JUnit test cases decide an area's status, instead of the status of the whole step, when their
+# class name ends in one of the area's words followed by "Test" (FooInstallTest, OrderLockTest).
+# Matching is case-sensitive, so a word only counts at a camelCase boundary: IblockRepositoryTest
+# is not a LockTest and ElementUpdateTest::testUpdateName is not an install/update test.
+AREA_TEST_TEMPLATE = r"(?:^|\\)\w*(?:{})Test(?:::|$)"
+AREA_TEST_PATTERNS = {
+    "A": re.compile(
+        AREA_TEST_TEMPLATE.format("Install|Uninstall|Reinstall|Migration|Upgrade|Updater")
+    ),
+    "B": re.compile(
+        AREA_TEST_TEMPLATE.format(
+            "Locali[sz]ation|Lang|Language|MagicNumber|Debug|CodeStyle|CodeQuality"
+        )
+    ),
+    "C": re.compile(AREA_TEST_TEMPLATE.format("E2[eE]|EndToEnd|Scenario|BusinessFlow")),
+    "D": re.compile(
+        AREA_TEST_TEMPLATE.format("Perf|Performance|Benchmark|LargeData|Scalability|Load")
+    ),
+    "E": re.compile(AREA_TEST_TEMPLATE.format("U[xX]|Pagination|LargeList")),
+    "F": re.compile(
+        AREA_TEST_TEMPLATE.format(
+            "Security|Rights|Permissions?|Access|AccessControl|C[sS][rR][fF]|Sessid|Session|"
+            "PathTraversal|Traversal|Sanitiz(?:e|er|ation)"
+        )
+    ),
+    "G": re.compile(
+        AREA_TEST_TEMPLATE.format(
+            "Lock|Locking|Concurrency|Parallel|Idempoten(?:t|cy)|Retry|Resume"
+        )
+    ),
+    "H": re.compile(AREA_TEST_TEMPLATE.format("Log|Logger|Logging|Diagnostics?")),
+    "I": re.compile(
+        AREA_TEST_TEMPLATE.format("Compat|Compatibility|P[hH][pP]8|M[yY][sS][qQ][lL]8|Platform")
+    ),
+}
+
+# Step output is streamed to a log file; only the last lines stay in memory for the report.
+OUTPUT_TAIL_LINES = 2000
+OUTPUT_LINE_CHARS = 4000
+# Reader threads get this long to drain pipes after a process tree is killed.
+OUTPUT_DRAIN_SEC = 5.0
+OUTPUT_LOCK = threading.Lock()
+
+DEFAULT_CLASS_DURATION_SEC = 1.0
+LIST_TESTS_TIMEOUT_SEC = 300
+
+
+@dataclass
+class CaseResult:
+    class_name: str
+    name: str
+    status: str
+    time: float
+    message: str = ""
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.class_name}::{self.name}" if self.class_name else self.name
+
+
+@dataclass
+class TestSummary:
+    cases: List[CaseResult] = field(default_factory=list)
+
+    def count(self, status: str) -> int:
+        return sum(1 for case in self.cases if case.status == status)
+
+    @property
+    def failed_cases(self) -> List[CaseResult]:
+        return [case for case in self.cases if case.status in (CASE_FAILED, CASE_ERROR)]
+
+    @property
+    def time(self) -> float:
+        return sum(case.time for case in self.cases)
+
+    def class_times(self) -> Dict[str, float]:
+        times: Dict[str, float] = {}
+        for case in self.cases:
+            if case.class_name:
+                times[case.class_name] = times.get(case.class_name, 0.0) + case.time
+        return times
+
 
 @dataclass
 class StepResult:
@@ -34,6 +170,60 @@ class StepResult:
     note: str
     stdout: str
     stderr: str
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    log_path: Optional[str] = None
+    # Line counts of the full output when stdout/stderr only hold its tail.
+    stdout_lines: Optional[int] = None
+    stderr_lines: Optional[int] = None
+    # Per test case results from the PHPUnit JUnit log, when one was written.
+    tests: Optional[TestSummary] = None
+
+
+@dataclass
+class OutputTail:
+    lines: Deque[str] = field(default_factory=lambda: deque(maxlen=OUTPUT_TAIL_LINES))
+    total: int = 0
+
+    def add(self, line: str) -> None:
+        self.total += 1
+        self.lines.append(line[:OUTPUT_LINE_CHARS])
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+@dataclass
+class StepSpec:
+    name: str
+    run: Callable[[], StepResult]
+    requires: List[str] = field(default_factory=list)
+
+
+@dataclass
+class TestTiming:
+    step: str
+    name: str
+    duration_sec: float
+    median_sec: Optional[float] = None
+
+
+@dataclass
+class SuiteTrend:
+    name: str
+    # Oldest first; the last entry is this run.
+    durations: List[float]
+
+
+@dataclass
+class HistoryReport:
+    path: str
+    runs: int
+    window: int
+    threshold_pct: float
+    suite_trends: List[SuiteTrend]
+    slowest: List[TestTiming]
+    regressions: List[TestTiming]
 
 
 @dataclass
@@ -111,6 +301,82 @@ def parse_args() -> argparse.Namespace:
         default=1200,
         help="Per command timeout in seconds. Default: 1200",
     )
+    parser.add_argument(
+        "--log-dir",
+        default=None,
+        help=(
+            "Directory for full per-step output logs. "
+            "Default: <report dir>/<report name>-logs"
+        ),
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Do not echo step output to the console (logs are still written).",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help=(
+            "Split each PHPUnit suite by test class across N parallel phpunit processes, "
+            "balanced by durations of earlier sharded runs. Integration is only sharded with "
+            "--shard-bitrix-root or --shard-db-prefix. Default: 1"
+        ),
+    )
+    parser.add_argument(
+        "--shard-bitrix-root",
+        default=None,
+        help=(
+            "BITRIX_ROOT of each integration shard, with {shard} replaced by 1..N "
+            "(example: /srv/bitrix-copy-{shard}). The copies must already exist."
+        ),
+    )
+    parser.add_argument(
+        "--shard-db-prefix",
+        default=None,
+        help=(
+            "Export BITRIX_TEST_DB_PREFIX=<prefix><shard>_ to each integration shard so the "
+            "test bootstrap can keep shard tables apart."
+        ),
+    )
+    parser.add_argument(
+        "--history-dir",
+        default=None,
+        help=(
+            "Directory of the SQLite timing history (step and per-test durations, used for "
+            "slow-test reports and --shards balancing). Default: <project-root>/tests/.qa-history"
+        ),
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Do not read or record timing history.",
+    )
+    parser.add_argument(
+        "--history-window",
+        type=int,
+        default=10,
+        help="Earlier runs that form the rolling median of each test. Default: 10",
+    )
+    parser.add_argument(
+        "--slow-threshold",
+        type=float,
+        default=25.0,
+        help=(
+            "Report tests that got more than this many percent slower than their rolling "
+            "median. Default: 25"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=2,
+        help=(
+            "Maximum steps running at once. Static steps run concurrently; integration "
+            "starts when both have finished. Use 1 for a sequential run. Default: 2"
+        ),
+    )
     return parser.parse_args()
 
 
@@ -159,14 +425,20 @@ def render_command(parts: List[str]) -> str:
     return shlex.join(parts)
 
 
-def trim_output(text: str, max_chars: int = 12000, max_lines: int = 140) -> str:
+def trim_output(
+    text: str,
+    max_chars: int = 12000,
+    max_lines: int = 140,
+    total_lines: Optional[int] = None,
+) -> str:
     stripped = text.strip()
     if not stripped:
         return "(empty)"
 
     lines = stripped.splitlines()
-    if len(lines) > max_lines:
-        lines = [f"[... trimmed, total lines: {len(stripped.splitlines())} ...]"] + lines[-max_lines:]
+    if len(lines) > max_lines or (total_lines or 0) > len(lines):
+        total = max(total_lines or 0, len(lines))
+        lines = [f"[... trimmed, total lines: {total} ...]"] + lines[-max_lines:]
     compact = "\n".join(lines)
 
     if len(compact) > max_chars:
@@ -175,6 +447,40 @@ def trim_output(text: str, max_chars: int = 12000, max_lines: int = 140) -> str:
     return compact
 
 
+def step_log_path(log_dir: Path, name: str) -> Path:
+    slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+    return log_dir / f"{slug}.log"
+
+
+def stream_output(
+    pipe: IO[str],
+    tail: OutputTail,
+    log: Optional[IO[str]],
+    log_prefix: str,
+    console: Optional[IO[str]],
+    console_prefix: str,
+) -> None:
+    for raw in pipe:
+        line = raw.rstrip("\r\n")
+        tail.add(line)
+        with OUTPUT_LOCK:
+            if log is not None and not log.closed:
+                log.write(f"{log_prefix}{line}\n")
+            if console is not None:
+                console.write(f"{console_prefix}{line}\n")
+                console.flush()
+
+
+def kill_process_tree(proc: subprocess.Popen) -> None:
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
+
+
 def run_command(
     name: str,
     cmd: List[str],
@@ -182,51 +488,344 @@ def run_command(
     timeout: int,
     env_additions: Optional[Dict[str, str]] = None,
     note_on_success: str = "",
+    log_dir: Optional[Path] = None,
+    echo: bool = True,
 ) -> StepResult:
     env = os.environ.copy()
     if env_additions:
         env.update(env_additions)
 
     started = datetime.now()
+    deadline = time.monotonic() + timeout
     command_str = render_command(cmd)
+    log_path = step_log_path(log_dir, name) if log_dir is not None else None
+    stdout_tail = OutputTail()
+    stderr_tail = OutputTail()
+
+    log = None
+    if log_path is not None:
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        log = log_path.open("w", encoding="utf-8")
+    try:
+        if log is not None:
+            log.write(f"$ {command_str}\n")
+        # The step runs in its own session so a timeout can kill the whole process tree.
+        proc = subprocess.Popen(
+            cmd,
+            cwd=str(project_root),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            start_new_session=os.name == "posix",
+        )
+        readers = [
+            threading.Thread(
+                target=stream_output,
+                args=(
+                    proc.stdout,
+                    stdout_tail,
+                    log,
+                    "",
+                    sys.stdout if echo else None,
+                    f"[{name}] ",
+                ),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=stream_output,
+                args=(
+                    proc.stderr,
+                    stderr_tail,
+                    log,
+                    "[stderr] ",
+                    sys.stderr if echo else None,
+                    f"[{name}] ",
+                ),
+                daemon=True,
+            ),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            exit_code: Optional[int] = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(proc)
+            proc.wait()
+            exit_code = None
+        # Background children that inherited stdout/stderr keep the pipes open after the
+        # command itself exits; they get the rest of the timeout, then their group is killed.
+        pipes_held = False
+        for reader in readers:
+            remaining = OUTPUT_DRAIN_SEC if exit_code is None else deadline - time.monotonic()
+            reader.join(max(remaining, 0))
+        if exit_code is not None and any(reader.is_alive() for reader in readers):
+            pipes_held = True
+            kill_process_tree(proc)
+            for reader in readers:
+                reader.join(OUTPUT_DRAIN_SEC)
+    finally:
+        if log is not None:
+            with OUTPUT_LOCK:
+                log.close()
+
+    finished = datetime.now()
+    if exit_code is None:
+        status = STATUS_FAIL
+        note = f"Command timed out after {timeout}s."
+    elif pipes_held:
+        status = STATUS_FAIL
+        note = (
+            f"Command exited with code {exit_code}, but processes it left running kept its "
+            f"output open; killed after {timeout}s."
+        )
+    else:
+        status = STATUS_PASS if exit_code == 0 else STATUS_FAIL
+        note = note_on_success if status == STATUS_PASS else "Command returned non-zero exit code."
+    return StepResult(
+        name=name,
+        status=status,
+        command=command_str,
+        exit_code=exit_code,
+        duration_sec=(finished - started).total_seconds(),
+        note=note,
+        stdout=stdout_tail.text(),
+        stderr=stderr_tail.text(),
+        started_at=started,
+        finished_at=finished,
+        log_path=str(log_path) if log_path is not None else None,
+        stdout_lines=stdout_tail.total,
+        stderr_lines=stderr_tail.total,
+    )
+
 
+def list_test_classes(
+    phpunit_bin: str,
+    suite: str,
+    project_root: Path,
+    env_additions: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    env = os.environ.copy()
+    if env_additions:
+        env.update(env_additions)
     try:
         proc = subprocess.run(
-            cmd,
+            [phpunit_bin, "-c", "phpunit.xml.dist", "--testsuite", suite, "--list-tests"],
             cwd=str(project_root),
             env=env,
             capture_output=True,
             text=True,
-            timeout=timeout,
+            timeout=LIST_TESTS_TIMEOUT_SEC,
             check=False,
         )
-        duration = (datetime.now() - started).total_seconds()
-        status = STATUS_PASS if proc.returncode == 0 else STATUS_FAIL
-        note = note_on_success if status == STATUS_PASS else "Command returned non-zero exit code."
-        return StepResult(
-            name=name,
-            status=status,
-            command=command_str,
-            exit_code=proc.returncode,
-            duration_sec=duration,
-            note=note,
-            stdout=proc.stdout,
-            stderr=proc.stderr,
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    if proc.returncode != 0:
+        return []
+
+    classes: List[str] = []
+    for line in proc.stdout.splitlines():
+        match = re.match(r"\s*-\s+([\w\\]+)::", line)
+        if match and match.group(1) not in classes:
+            classes.append(match.group(1))
+    return classes
+
+
+def parse_junit(path: Path) -> Optional[TestSummary]:
+    # Streaming: each <testcase> is dropped from the tree once read, so memory stays flat for
+    # logs with tens of thousands of cases.
+    summary = TestSummary()
+    try:
+        for _, element in ElementTree.iterparse(str(path)):
+            if element.tag == "testsuite":
+                element.clear()
+            if element.tag != "testcase":
+                continue
+            status, message = CASE_PASSED, ""
+            for child in element:
+                if child.tag in ("failure", "error"):
+                    status = CASE_FAILED if child.tag == "failure" else CASE_ERROR
+                    message = child.get("message") or (child.text or "").strip()
+                    break
+                if child.tag == "skipped":
+                    status, message = CASE_SKIPPED, child.get("message") or ""
+            class_name = element.get("class") or (element.get("classname") or "").replace(".", "\\")
+            try:
+                case_time = float(element.get("time") or 0.0)
+            except ValueError:
+                case_time = 0.0
+            summary.cases.append(
+                CaseResult(
+                    class_name=class_name,
+                    name=element.get("name") or "",
+                    status=status,
+                    time=case_time,
+                    message=message[:CASE_MESSAGE_CHARS],
+                )
+            )
+            element.clear()
+    except (OSError, ElementTree.ParseError):
+        return summary if summary.cases else None
+    return summary
+
+
+def split_shards(classes: List[str], durations: Dict[str, float], shards: int) -> List[List[str]]:
+    # Longest first, each class onto the currently lightest shard. Classes without history
+    # count as the median known class.
+    known = sorted(durations[name] for name in classes if name in durations)
+    default = known[len(known) // 2] if known else DEFAULT_CLASS_DURATION_SEC
+    weighted = sorted(classes, key=lambda name: (-durations.get(name, default), name))
+    loads = [(0.0, index) for index in range(min(shards, len(classes)))]
+    groups: List[List[str]] = [[] for _ in loads]
+    for name in weighted:
+        load, index = heapq.heappop(loads)
+        groups[index].append(name)
+        heapq.heappush(loads, (load + durations.get(name, default), index))
+    return groups
+
+
+def class_filter(classes: List[str]) -> str:
+    escaped = "|".join(name.replace("\\", "\\\\") for name in sorted(classes))
+    return f"/^(?:{escaped})::/"
+
+
+def merge_shard_results(
+    name: str,
+    command: str,
+    parts: List[StepResult],
+    note_on_success: str,
+) -> StepResult:
+    started = min(part.started_at for part in parts if part.started_at)
+    finished = max(part.finished_at for part in parts if part.finished_at)
+    failed = [part for part in parts if part.status == STATUS_FAIL]
+    timed_out = [part for part in parts if part.exit_code is None]
+    exit_codes = [part.exit_code for part in parts if part.exit_code]
+    if failed:
+        note = "Failed shards: " + "; ".join(f"{part.name}: {part.note}" for part in failed)
+    else:
+        note = note_on_success
+
+    def merged(attr: str) -> str:
+        return "\n".join(
+            f"=== {part.name} ===\n{getattr(part, attr)}" for part in parts if getattr(part, attr)
+        )
+
+    def merged_lines(attr: str) -> int:
+        return sum(
+            (getattr(part, f"{attr}_lines") or 0) + 1 for part in parts if getattr(part, attr)
         )
-    except subprocess.TimeoutExpired as exc:
-        duration = (datetime.now() - started).total_seconds()
-        stdout = exc.stdout or ""
-        stderr = exc.stderr or ""
-        return StepResult(
+
+    return StepResult(
+        name=name,
+        status=STATUS_FAIL if failed else STATUS_PASS,
+        command=command,
+        exit_code=None if timed_out else (exit_codes[0] if exit_codes else 0),
+        duration_sec=(finished - started).total_seconds(),
+        note=note,
+        stdout=merged("stdout"),
+        stderr=merged("stderr"),
+        started_at=started,
+        finished_at=finished,
+        log_path=", ".join(part.log_path for part in parts if part.log_path) or None,
+        stdout_lines=merged_lines("stdout"),
+        stderr_lines=merged_lines("stderr"),
+        tests=TestSummary([case for part in parts if part.tests for case in part.tests.cases])
+        if any(part.tests for part in parts)
+        else None,
+    )
+
+
+def run_junit_command(
+    name: str,
+    cmd: List[str],
+    project_root: Path,
+    timeout: int,
+    log_dir: Path,
+    echo: bool,
+    note_on_success: str,
+    env_additions: Optional[Dict[str, str]] = None,
+) -> StepResult:
+    junit_path = step_log_path(log_dir, name).with_suffix(".junit.xml")
+    junit_path.unlink(missing_ok=True)
+    result = run_command(
+        name=name,
+        cmd=cmd + ["--log-junit", str(junit_path)],
+        project_root=project_root,
+        timeout=timeout,
+        env_additions=env_additions,
+        log_dir=log_dir,
+        echo=echo,
+        note_on_success=note_on_success,
+    )
+    result.tests = parse_junit(junit_path)
+    return result
+
+
+def run_phpunit_suite(
+    name: str,
+    suite: str,
+    phpunit_bin: str,
+    project_root: Path,
+    timeout: int,
+    log_dir: Path,
+    echo: bool,
+    note_on_success: str,
+    env_additions: Optional[Dict[str, str]] = None,
+    shards: int = 1,
+    shard_env: Optional[Callable[[int], Dict[str, str]]] = None,
+    class_durations: Optional[Dict[str, float]] = None,
+) -> StepResult:
+    cmd = [phpunit_bin, "-c", "phpunit.xml.dist", "--testsuite", suite]
+    classes: List[str] = []
+    if shards > 1:
+        classes = list_test_classes(phpunit_bin, suite, project_root, env_additions)
+
+    if len(classes) < 2:
+        result = run_junit_command(
             name=name,
-            status=STATUS_FAIL,
-            command=command_str,
-            exit_code=None,
-            duration_sec=duration,
-            note=f"Command timed out after {timeout}s.",
-            stdout=stdout,
-            stderr=stderr,
+            cmd=cmd,
+            project_root=project_root,
+            timeout=timeout,
+            log_dir=log_dir,
+            echo=echo,
+            note_on_success=note_on_success,
+            env_additions=env_additions,
         )
+        if shards > 1 and result.status == STATUS_PASS:
+            result.note = f"{note_on_success} Ran unsharded: fewer than 2 test classes were listed."
+    else:
+        groups = split_shards(classes, class_durations or {}, shards)
+
+        def run_shard(index: int) -> StepResult:
+            env = dict(env_additions or {})
+            if shard_env is not None:
+                env.update(shard_env(index + 1))
+            env.update({"BITRIX_QA_SHARD": str(index + 1), "BITRIX_QA_SHARDS": str(len(groups))})
+            return run_junit_command(
+                name=f"{name} (shard {index + 1}/{len(groups)})",
+                cmd=cmd + ["--filter", class_filter(groups[index])],
+                project_root=project_root,
+                timeout=timeout,
+                log_dir=log_dir,
+                echo=echo,
+                note_on_success=f"{len(groups[index])} test classes passed.",
+                env_additions=env,
+            )
+
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            parts = list(pool.map(run_shard, range(len(groups))))
+        command = f"{render_command(cmd)} --filter <{len(groups)} shards by class>"
+        result = merge_shard_results(name, command, parts, note_on_success)
+    return result
+
+
+def step_executed(step: StepResult) -> bool:
+    # Steps that were not run have no start time. A step that ran keeps it even when its status
+    # is relabelled N-A (e.g. an integration suite with skipped tests).
+    return step.started_at is not None
 
 
 def make_na_step(name: str, note: str) -> StepResult:
@@ -242,6 +841,181 @@ def make_na_step(name: str, note: str) -> StepResult:
     )
 
 
+def run_steps(specs: List[StepSpec], jobs: int) -> List[StepResult]:
+    """Run steps as soon as all their prerequisites have finished; results keep spec order."""
+    names = {spec.name for spec in specs}
+    for spec in specs:
+        missing = [name for name in spec.requires if name not in names]
+        if missing:
+            raise ValueError(f"Step {spec.name!r} requires unknown steps: {', '.join(missing)}")
+
+    pending = list(specs)
+    done: Dict[str, StepResult] = {}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        running: Dict[Future, str] = {}
+        while pending or running:
+            ready = [spec for spec in pending if all(name in done for name in spec.requires)]
+            for spec in ready:
+                pending.remove(spec)
+                running[pool.submit(spec.run)] = spec.name
+            if not running:
+                cycle = ", ".join(spec.name for spec in pending)
+                raise ValueError(f"Step prerequisites form a cycle: {cycle}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done[running.pop(future)] = future.result()
+    return [done[spec.name] for spec in specs]
+
+
+class TimingHistory:
+    """SQLite store of step and per-test durations, kept for the last HISTORY_KEEP_RUNS runs.
+
+    Runs are scoped by module ID, so modules sharing one store keep separate baselines.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript(HISTORY_SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def class_durations(self, step: str, module_id: str) -> Dict[str, float]:
+        # Total case time of each class in the latest run that included it (shard balancing).
+        rows = self.db.execute(
+            "SELECT class_name, SUM(duration_sec) FROM tests AS t "
+            "WHERE step = ? AND run_id = ("
+            "  SELECT MAX(run_id) FROM tests JOIN runs ON runs.id = tests.run_id "
+            "  WHERE step = t.step AND class_name = t.class_name AND module_id = ?"
+            ") GROUP BY class_name",
+            (step, module_id),
+        )
+        return {class_name: duration for class_name, duration in rows if class_name}
+
+    def record_run(self, results: List[StepResult], module_id: str, started_at: datetime) -> int:
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (started_at, module_id, overall) VALUES (?, ?, ?)",
+                (started_at.isoformat(timespec="seconds"), module_id, compute_overall(results)),
+            )
+            run_id = int(cursor.lastrowid)
+            # A step that ran can still be reported N-A (e.g. integration with skipped tests),
+            # so whether it ran is stored apart from its status.
+            self.db.executemany(
+                "INSERT INTO steps (run_id, name, status, duration_sec, executed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (run_id, item.name, item.status, item.duration_sec, step_executed(item))
+                    for item in results
+                ],
+            )
+            for item in results:
+                if item.tests is None:
+                    continue
+                self.db.executemany(
+                    "INSERT INTO tests (run_id, step, class_name, name, status, duration_sec) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (run_id, item.name, case.class_name, case.name, case.status, case.time)
+                        for case in item.tests.cases
+                    ),
+                )
+            expired = [
+                row[0]
+                for row in self.db.execute(
+                    "SELECT id FROM runs WHERE module_id = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                    (module_id, HISTORY_KEEP_RUNS),
+                )
+            ]
+            for table, column in (("tests", "run_id"), ("steps", "run_id"), ("runs", "id")):
+                self.db.executemany(
+                    f"DELETE FROM {table} WHERE {column} = ?", [(old_id,) for old_id in expired]
+                )
+        return run_id
+
+    def report(
+        self,
+        run_id: int,
+        module_id: str,
+        results: List[StepResult],
+        window: int,
+        threshold_pct: float,
+    ) -> HistoryReport:
+        previous = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT id FROM runs WHERE module_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (module_id, run_id, window),
+            )
+        ]
+        placeholders = ",".join("?" * len(previous))
+
+        samples: Dict[Tuple[str, str, str], List[float]] = {}
+        if previous:
+            rows = self.db.execute(
+                "SELECT step, class_name, name, duration_sec FROM tests "
+                f"WHERE status = ? AND run_id IN ({placeholders})",
+                [CASE_PASSED] + previous,
+            )
+            for step, class_name, name, duration in rows:
+                samples.setdefault((step, class_name, name), []).append(duration)
+
+        timings: List[TestTiming] = []
+        regressions: List[TestTiming] = []
+        for item in results:
+            if item.tests is None:
+                continue
+            for case in item.tests.cases:
+                history = samples.get((item.name, case.class_name, case.name), [])
+                median = statistics.median(history) if history else None
+                timing = TestTiming(item.name, case.full_name, case.time, median)
+                timings.append(timing)
+                if (
+                    case.status == CASE_PASSED
+                    and median is not None
+                    and len(history) >= REGRESSION_MIN_SAMPLES
+                    and case.time >= REGRESSION_MIN_SEC
+                    and case.time > median * (1 + threshold_pct / 100)
+                ):
+                    regressions.append(timing)
+        timings.sort(key=lambda timing: -timing.duration_sec)
+        regressions.sort(key=lambda timing: -timing.duration_sec / (timing.median_sec or 1e-9))
+
+        step_durations: Dict[str, Dict[int, float]] = {}
+        for step_run, name, duration in self.db.execute(
+            "SELECT run_id, name, duration_sec FROM steps "
+            f"WHERE executed = 1 AND run_id IN ({','.join('?' * (len(previous) + 1))})",
+            [run_id] + previous,
+        ):
+            step_durations.setdefault(name, {})[step_run] = duration
+        trends = [
+            SuiteTrend(item.name, [durations[key] for key in sorted(durations)])
+            for item in results
+            if (durations := step_durations.get(item.name)) and run_id in durations
+        ]
+
+        runs = self.db.execute(
+            "SELECT COUNT(*) FROM runs WHERE module_id = ?", (module_id,)
+        ).fetchone()[0]
+        return HistoryReport(
+            path=str(self.path),
+            runs=runs,
+            window=window,
+            threshold_pct=threshold_pct,
+            suite_trends=trends,
+            slowest=timings[:HISTORY_REPORT_ROWS],
+            regressions=regressions[:HISTORY_REPORT_ROWS],
+        )
+
+
+def count_skips(step: StepResult) -> Optional[int]:
+    if step.tests is not None:
+        return step.tests.count(CASE_SKIPPED) or None
+    return detect_skips(step.stdout, step.stderr)
+
+
 def detect_skips(stdout: str, stderr: str) -> Optional[int]:
     merged = "\n".join([stdout or "", stderr or ""])
     matches = re.findall(r"(\d+)\s+skipped", merged, flags=re.IGNORECASE)
@@ -271,6 +1045,14 @@ def extract_step_evidence(step: Optional[StepResult]) -> str:
     if step.status == STATUS_NA:
         return clip_text(step.note)
 
+    failed_cases = step.tests.failed_cases if step.tests is not None else []
+    if failed_cases:
+        first = failed_cases[0]
+        return clip_text(
+            f"{step.name}: {len(failed_cases)} of {len(step.tests.cases)} tests failed; "
+            f"{first.full_name}: {first.message or first.status}"
+        )
+
     merged = "\n".join([step.stdout or "", step.stderr or ""])
     lines = [line.strip() for line in merged.splitlines() if line.strip()]
     if not lines:
@@ -348,6 +1130,40 @@ def risk_for_area(code: str, status: str) -> str:
     return RISK_LOW
 
 
+def refine_area_with_tests(
+    code: str,
+    status: str,
+    evidence: str,
+    steps: List[Optional[StepResult]],
+) -> Tuple[str, str]:
+    pattern = AREA_TEST_PATTERNS.get(code)
+    ran = [step for step in steps if step is not None and step.status != STATUS_NA]
+    cases = [
+        case
+        for step in ran
+        if step.tests is not None
+        for case in step.tests.cases
+        if pattern is not None and pattern.search(case.full_name)
+    ]
+    if not cases:
+        return status, evidence
+
+    failed = [case for case in cases if case.status in (CASE_FAILED, CASE_ERROR)]
+    if failed:
+        first = failed[0]
+        return STATUS_FAIL, clip_text(
+            f"{len(failed)} of {len(cases)} area tests failed; "
+            f"{first.full_name}: {first.message or first.status}"
+        )
+    # A step that failed without failing test cases (fatal error, timeout) still fails its areas.
+    if any(step.status == STATUS_FAIL and not (step.tests and step.tests.failed_cases) for step in ran):
+        return status, evidence
+    passed = sum(1 for case in cases if case.status == CASE_PASSED)
+    if not passed:
+        return STATUS_NA, clip_text(f"All {len(cases)} area tests were skipped.")
+    return STATUS_PASS, clip_text(f"{passed} of {len(cases)} area tests passed.")
+
+
 def derive_area_results(results: List[StepResult]) -> List[AreaResult]:
     by_name = {item.name: item for item in results}
     static_shell = by_name.get("Static Shell Audit")
@@ -356,7 +1172,14 @@ def derive_area_results(results: List[StepResult]) -> List[AreaResult]:
 
     area_rows: List[AreaResult] = []
 
-    def add_area(code: str, title: str, status: str, evidence: str) -> None:
+    def add_area(
+        code: str,
+        title: str,
+        status: str,
+        evidence: str,
+        test_steps: List[Optional[StepResult]],
+    ) -> None:
+        status, evidence = refine_area_with_tests(code, status, evidence, test_steps)
         area_rows.append(
             AreaResult(
                 code=code,
@@ -373,54 +1196,63 @@ def derive_area_results(results: List[StepResult]) -> List[AreaResult]:
         "Install/Uninstall/Update",
         integration.status if integration else STATUS_NA,
         extract_step_evidence(integration),
+        [integration],
     )
     add_area(
         "B",
         "Code quality (localization, magic numbers, debug)",
         combine_step_statuses([static_phpunit, static_shell]),
         combine_step_evidence([static_phpunit, static_shell]),
+        [static_phpunit],
     )
     add_area(
         "C",
         "Core E2E scenarios",
         integration.status if integration else STATUS_NA,
         extract_step_evidence(integration),
+        [integration],
     )
     add_area(
         "D",
         "Performance and scaling",
         STATUS_NA,
         "No automated benchmark in qa_run.py; requires manual/perf suite execution.",
+        [static_phpunit, integration],
     )
     add_area(
         "E",
         "UX on large datasets",
         STATUS_NA,
         "No automated UI load checks in qa_run.py; requires manual QA validation.",
+        [static_phpunit, integration],
     )
     add_area(
         "F",
         "Security (rights, CSRF, path traversal)",
         static_phpunit.status if static_phpunit else STATUS_NA,
         extract_step_evidence(static_phpunit),
+        [static_phpunit],
     )
     add_area(
         "G",
         "Reliability (locks, resume, parallelism)",
         integration.status if integration else STATUS_NA,
         extract_step_evidence(integration),
+        [integration],
     )
     add_area(
         "H",
         "Diagnostics and logs",
         combine_step_statuses([integration, static_shell]),
         combine_step_evidence([integration, static_shell]),
+        [integration],
     )
     add_area(
         "I",
         "Compatibility",
         integration.status if integration else STATUS_NA,
         extract_step_evidence(integration),
+        [integration],
     )
 
     return area_rows
@@ -500,25 +1332,98 @@ def compute_overall(results: List[StepResult]) -> str:
     return STATUS_PASS
 
 
+def format_change(duration: float, baseline: Optional[float]) -> str:
+    if not baseline:
+        return "-"
+    return f"{(duration / baseline - 1) * 100:+.0f}%"
+
+
+def render_history(history: HistoryReport) -> List[str]:
+    lines: List[str] = []
+    lines.append("")
+    lines.append("## Timing History")
+    lines.append("")
+    lines.append(f"- Store: `{history.path}` ({history.runs} runs of this module kept)")
+    lines.append(f"- Rolling median over the previous {history.window} runs")
+
+    lines.append("")
+    lines.append("### Suite Duration Trend")
+    lines.append("")
+    if not history.suite_trends:
+        lines.append("- No executed steps.")
+    else:
+        lines.append("| Step | Earlier runs (s, oldest first) | Median (s) | This run (s) | Change |")
+        lines.append("|---|---|---:|---:|---:|")
+        for trend in history.suite_trends:
+            earlier = trend.durations[:-1]
+            median = statistics.median(earlier) if earlier else None
+            current = trend.durations[-1]
+            lines.append(
+                f"| {trend.name} | {' -> '.join(f'{value:.2f}' for value in earlier) or '-'} | "
+                f"{'-' if median is None else f'{median:.2f}'} | {current:.2f} | "
+                f"{format_change(current, median)} |"
+            )
+
+    lines.append("")
+    lines.append("### Slowest Tests")
+    lines.append("")
+    if not history.slowest:
+        lines.append("- No per-test timings (no JUnit results).")
+    else:
+        lines.append("| Test | Step | Time (s) | Median (s) |")
+        lines.append("|---|---|---:|---:|")
+        for timing in history.slowest:
+            median = "-" if timing.median_sec is None else f"{timing.median_sec:.2f}"
+            lines.append(
+                f"| {md_cell(timing.name, limit=120)} | {timing.step} | "
+                f"{timing.duration_sec:.2f} | {median} |"
+            )
+
+    lines.append("")
+    lines.append(f"### Slower Than Rolling Median (> {history.threshold_pct:g}%)")
+    lines.append("")
+    if not history.regressions:
+        lines.append("- No regressions detected.")
+    else:
+        lines.append("| Test | Step | Median (s) | This run (s) | Change |")
+        lines.append("|---|---|---:|---:|---:|")
+        for timing in history.regressions:
+            lines.append(
+                f"| {md_cell(timing.name, limit=120)} | {timing.step} | {timing.median_sec:.2f} | "
+                f"{timing.duration_sec:.2f} | {format_change(timing.duration_sec, timing.median_sec)} |"
+            )
+    return lines
+
+
 def build_report(
     results: List[StepResult],
     report_path: Path,
     project_root: Path,
     module_id: str,
     bitrix_root: Optional[str],
+    history: Optional[HistoryReport] = None,
 ) -> str:
     generated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     overall = compute_overall(results)
 
+    # Steps run concurrently, so the flow check compares run times instead of list order.
     static_names = {"Static Shell Audit", "PHPUnit Static Suite"}
-    static_indexes = [idx for idx, item in enumerate(results) if item.name in static_names and item.status != STATUS_NA]
-    integration_indexes = [idx for idx, item in enumerate(results) if item.name == "PHPUnit Integration Suite" and item.status != STATUS_NA]
-    if not integration_indexes:
+    static_finishes = [
+        item.finished_at
+        for item in results
+        if item.name in static_names and step_executed(item) and item.finished_at
+    ]
+    integration_starts = [
+        item.started_at
+        for item in results
+        if item.name == "PHPUnit Integration Suite" and step_executed(item)
+    ]
+    if not integration_starts:
         flow_label = "N-A"
-    elif not static_indexes:
+    elif not static_finishes:
         flow_label = "No"
     else:
-        flow_label = "Yes" if max(static_indexes) < min(integration_indexes) else "No"
+        flow_label = "Yes" if max(static_finishes) <= min(integration_starts) else "No"
 
     lines: List[str] = []
     lines.append("# QA Run Report")
@@ -546,6 +1451,36 @@ def build_report(
             f"| {item.name} | {item.status} | {exit_code} | {item.duration_sec:.2f} | `{item.command}` |"
         )
 
+    tested = [item for item in results if item.tests is not None]
+    if tested:
+        lines.append("")
+        lines.append("## Test Results (JUnit)")
+        lines.append("")
+        lines.append("| Step | Tests | Passed | Failed | Errors | Skipped | Test time (s) |")
+        lines.append("|---|---:|---:|---:|---:|---:|---:|")
+        for item in tested:
+            summary = item.tests
+            lines.append(
+                f"| {item.name} | {len(summary.cases)} | {summary.count(CASE_PASSED)} | "
+                f"{summary.count(CASE_FAILED)} | {summary.count(CASE_ERROR)} | "
+                f"{summary.count(CASE_SKIPPED)} | {summary.time:.2f} |"
+            )
+        failed_cases = [case for item in tested for case in item.tests.failed_cases]
+        if failed_cases:
+            lines.append("")
+            lines.append("| Failed test | Status | Time (s) | Message |")
+            lines.append("|---|---|---:|---|")
+            for case in failed_cases[:REPORT_FAILED_CASES]:
+                lines.append(
+                    f"| {md_cell(case.full_name, limit=120)} | {case.status} | {case.time:.2f} | "
+                    f"{md_cell(case.message or '-')} |"
+                )
+            if len(failed_cases) > REPORT_FAILED_CASES:
+                lines.append("")
+                lines.append(
+                    f"- {len(failed_cases) - REPORT_FAILED_CASES} more failed tests are in the JUnit logs."
+                )
+
     area_rows = derive_area_results(results)
     backlog = build_backlog(area_rows)
 
@@ -587,6 +1522,9 @@ def build_report(
             )
         lines.append("")
 
+    if history is not None:
+        lines.extend(render_history(history))
+
     recommendations = build_recommendations(results, project_root, module_id)
     lines.append("")
     lines.append("## Recommendations")
@@ -603,20 +1541,22 @@ def build_report(
         lines.append(f"- Status: {item.status}")
         lines.append(f"- Note: {item.note or '-'}")
         lines.append(f"- Command: `{item.command}`")
+        if item.log_path:
+            lines.append(f"- Full log: `{item.log_path}`")
         lines.append("")
         lines.append("stdout:")
         lines.append("```text")
-        lines.append(trim_output(item.stdout))
+        lines.append(trim_output(item.stdout, total_lines=item.stdout_lines))
         lines.append("```")
         lines.append("")
         lines.append("stderr:")
         lines.append("```text")
-        lines.append(trim_output(item.stderr))
+        lines.append(trim_output(item.stderr, total_lines=item.stderr_lines))
         lines.append("```")
         lines.append("")
 
         if item.name == "PHPUnit Integration Suite":
-            skipped = detect_skips(item.stdout, item.stderr)
+            skipped = count_skips(item)
             if skipped is not None:
                 lines.append(f"- Skipped tests detected: {skipped}")
                 lines.append("")
@@ -631,8 +1571,47 @@ def main() -> int:
     if not project_root.exists() or not project_root.is_dir():
         raise SystemExit(f"Project root does not exist: {project_root}")
 
+    if args.shards < 1:
+        raise SystemExit("--shards must be at least 1.")
+    if args.history_window < 1:
+        raise SystemExit("--history-window must be at least 1.")
+    if args.shard_bitrix_root and "{shard}" not in args.shard_bitrix_root:
+        raise SystemExit("--shard-bitrix-root must contain {shard}.")
+    if args.shard_bitrix_root and args.shards > 1:
+        for shard in range(1, args.shards + 1):
+            shard_root = Path(args.shard_bitrix_root.replace("{shard}", str(shard))).expanduser()
+            if not shard_root.is_dir():
+                raise SystemExit(f"Shard Bitrix root does not exist: {shard_root}")
+
     report_path = resolve_report_path(project_root, args.report)
     report_path.parent.mkdir(parents=True, exist_ok=True)
+    if args.log_dir:
+        log_dir = Path(args.log_dir).expanduser().resolve()
+    else:
+        log_dir = report_path.parent / f"{report_path.stem}-logs"
+
+    started = datetime.now()
+    history: Optional[TimingHistory] = None
+    if not args.no_history:
+        if args.history_dir:
+            history_dir = Path(args.history_dir).expanduser().resolve()
+        else:
+            history_dir = project_root / HISTORY_DIR
+        try:
+            history = TimingHistory(history_dir / HISTORY_FILE_NAME)
+        except (OSError, sqlite3.Error) as exc:
+            print(f"Timing history disabled: {exc}", file=sys.stderr)
+
+    def class_durations(step: str) -> Dict[str, float]:
+        if history is None or args.shards < 2:
+            return {}
+        try:
+            return history.class_durations(step, args.module_id)
+        except sqlite3.Error:
+            return {}
+
+    static_durations = class_durations("PHPUnit Static Suite")
+    integration_durations = class_durations("PHPUnit Integration Suite")
 
     bitrix_root = args.bitrix_root or os.getenv("BITRIX_ROOT")
     static_script = discover_static_script(project_root, args.static_script)
@@ -640,95 +1619,136 @@ def main() -> int:
     phpunit_bin = discover_phpunit(project_root, args.phpunit_bin)
     phpunit_config = project_root / "phpunit.xml.dist"
 
-    results: List[StepResult] = []
-
-    if args.skip_static_script:
-        results.append(make_na_step("Static Shell Audit", "Skipped by --skip-static-script."))
-    elif static_script is None:
-        results.append(
-            make_na_step(
+    def static_shell_step() -> StepResult:
+        if args.skip_static_script:
+            return make_na_step("Static Shell Audit", "Skipped by --skip-static-script.")
+        if static_script is None:
+            return make_na_step(
                 "Static Shell Audit",
                 "No static shell script found (qa-static-audit.sh).",
             )
-        )
-    else:
-        results.append(
-            run_command(
-                name="Static Shell Audit",
-                cmd=["bash", str(static_script)],
-                project_root=project_root,
-                timeout=args.timeout,
-                note_on_success="Static shell audit completed.",
-            )
+        return run_command(
+            name="Static Shell Audit",
+            cmd=["bash", str(static_script)],
+            project_root=project_root,
+            timeout=args.timeout,
+            log_dir=log_dir,
+            echo=not args.quiet,
+            note_on_success="Static shell audit completed.",
         )
 
-    if not phpunit_config.exists():
-        results.append(
-            make_na_step(
+    def static_phpunit_step() -> StepResult:
+        if not phpunit_config.exists():
+            return make_na_step(
                 "PHPUnit Static Suite",
                 "phpunit.xml.dist not found in project root.",
             )
-        )
-    elif phpunit_bin is None:
-        results.append(
-            make_na_step(
+        if phpunit_bin is None:
+            return make_na_step(
                 "PHPUnit Static Suite",
                 "phpunit executable not found. Run composer install or set --phpunit-bin.",
             )
-        )
-    else:
-        results.append(
-            run_command(
-                name="PHPUnit Static Suite",
-                cmd=[phpunit_bin, "-c", "phpunit.xml.dist", "--testsuite", "static"],
-                project_root=project_root,
-                timeout=args.timeout,
-                note_on_success="Static PHPUnit suite completed.",
-            )
+        return run_phpunit_suite(
+            name="PHPUnit Static Suite",
+            suite="static",
+            phpunit_bin=phpunit_bin,
+            project_root=project_root,
+            timeout=args.timeout,
+            log_dir=log_dir,
+            echo=not args.quiet,
+            note_on_success="Static PHPUnit suite completed.",
+            shards=args.shards,
+            class_durations=static_durations,
         )
 
-    if args.skip_integration:
-        results.append(make_na_step("PHPUnit Integration Suite", "Skipped by --skip-integration."))
-    elif not phpunit_config.exists():
-        results.append(
-            make_na_step(
+    def integration_shard_env(shard: int) -> Dict[str, str]:
+        env: Dict[str, str] = {}
+        if args.shard_bitrix_root:
+            env["BITRIX_ROOT"] = args.shard_bitrix_root.replace("{shard}", str(shard))
+        if args.shard_db_prefix:
+            env["BITRIX_TEST_DB_PREFIX"] = f"{args.shard_db_prefix}{shard}_"
+        return env
+
+    def integration_step() -> StepResult:
+        if args.skip_integration:
+            return make_na_step("PHPUnit Integration Suite", "Skipped by --skip-integration.")
+        if not phpunit_config.exists():
+            return make_na_step(
                 "PHPUnit Integration Suite",
                 "phpunit.xml.dist not found in project root.",
             )
-        )
-    elif phpunit_bin is None:
-        results.append(
-            make_na_step(
+        if phpunit_bin is None:
+            return make_na_step(
                 "PHPUnit Integration Suite",
                 "phpunit executable not found. Run composer install or set --phpunit-bin.",
             )
-        )
-    elif not bitrix_root:
-        results.append(
-            make_na_step(
+        if not bitrix_root:
+            return make_na_step(
                 "PHPUnit Integration Suite",
                 "BITRIX_ROOT is not set (use --bitrix-root or environment variable).",
             )
-        )
-    else:
-        integration_result = run_command(
+        # Integration shards share the Bitrix installation unless each gets its own copy or
+        # table prefix, so they are only split when one of those is configured.
+        isolated = bool(args.shard_bitrix_root or args.shard_db_prefix)
+        integration_result = run_phpunit_suite(
             name="PHPUnit Integration Suite",
-            cmd=[phpunit_bin, "-c", "phpunit.xml.dist", "--testsuite", "integration"],
+            suite="integration",
+            phpunit_bin=phpunit_bin,
             project_root=project_root,
             timeout=args.timeout,
+            log_dir=log_dir,
+            echo=not args.quiet,
             env_additions={
                 "BITRIX_ROOT": bitrix_root,
                 "BITRIX_MODULE_ID": args.module_id,
             },
             note_on_success="Integration PHPUnit suite completed.",
+            shards=args.shards if isolated else 1,
+            shard_env=integration_shard_env,
+            class_durations=integration_durations,
         )
-        skipped = detect_skips(integration_result.stdout, integration_result.stderr)
+        if args.shards > 1 and not isolated and integration_result.status == STATUS_PASS:
+            integration_result.note += (
+                " Ran unsharded: set --shard-bitrix-root or --shard-db-prefix to shard it."
+            )
+        skipped = count_skips(integration_result)
         if integration_result.status == STATUS_PASS and skipped:
             integration_result.status = STATUS_NA
             integration_result.note = (
                 f"Integration suite contains skipped tests ({skipped}); treated as N-A."
             )
-        results.append(integration_result)
+        return integration_result
+
+    # Integration waits for both static steps (whatever their status) to keep the
+    # static-before-integration flow; the static steps are independent of each other.
+    results = run_steps(
+        [
+            StepSpec("Static Shell Audit", static_shell_step),
+            StepSpec("PHPUnit Static Suite", static_phpunit_step),
+            StepSpec(
+                "PHPUnit Integration Suite",
+                integration_step,
+                requires=["Static Shell Audit", "PHPUnit Static Suite"],
+            ),
+        ],
+        jobs=args.jobs,
+    )
+
+    history_report = None
+    if history is not None:
+        try:
+            run_id = history.record_run(results, args.module_id, started)
+            history_report = history.report(
+                run_id,
+                args.module_id,
+                results,
+                window=args.history_window,
+                threshold_pct=args.slow_threshold,
+            )
+        except sqlite3.Error as exc:
+            print(f"Timing history not updated: {exc}", file=sys.stderr)
+        finally:
+            history.close()
 
     report = build_report(
         results=results,
@@ -736,6 +1756,7 @@ def main() -> int:
         project_root=project_root,
         module_id=args.module_id,
         bitrix_root=bitrix_root,
+        history=history_report,
     )
     report_path.write_text(report, encoding="utf-8")
 
@@ -24,6 +24,9 @@ GITIGNORE_ENTRIES = [
     "/bitrix/managed_cache/",
     "/bitrix/stack_cache/",
     "/bitrix/logs/",
+    # qa_run.py timing history and per-step output, JUnit and shard logs.
+    "tests/.qa-history/",
+    "tests/qa-run-report-*-logs/",
 ]
 
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Query a running `search_reference_dump.py --serve --socket` server.
+
+Imports only the stdlib pieces a request needs, so a repeat query costs interpreter startup plus
+the server's answer instead of loading the whole search module the way `--connect` does.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import socket
+import sys
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Send one query to a search_reference_dump.py --serve --socket server."
+    )
+    parser.add_argument("--socket", required=True, help="Unix socket path of the server.")
+    parser.add_argument("--query", required=True, help="Search query.")
+    parser.add_argument("--limit", type=int, default=10, help="Max results. Default: 10")
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=0.0,
+        help="Minimum BM25F score for a result. Default: 0",
+    )
+    parser.add_argument(
+        "--fuzzy",
+        type=int,
+        default=None,
+        help="Typo tolerance (0-2) for this query. Default: the server's --fuzzy.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", "jsonl"),
+        default="text",
+        help="Output format, same as search_reference_dump.py --format. Default: text",
+    )
+    return parser.parse_args()
+
+
+def query_server(socket_path: str, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with client.makefile("rb") as stream:
+            return json.loads(stream.readline() or b"{}")
+
+
+def format_result(rank: int, item: dict) -> str:
+    # Same layout as format_match() in search_reference_dump.py.
+    lines = [f"{rank}. [{item['score']:.3f}] {item['source']}", f"   {item['snippet']}"]
+    aliases = item.get("aliases") or []
+    if aliases:
+        more = f" (+{len(aliases) - 3} more)" if len(aliases) > 3 else ""
+        lines.append(f"   also: {', '.join(aliases[:3])}{more}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    args = parse_args()
+    request = {"query": args.query, "limit": args.limit, "min_score": args.min_score}
+    if args.fuzzy is not None:
+        request["fuzzy"] = args.fuzzy
+    try:
+        response = query_server(args.socket, request)
+    except (OSError, ValueError) as exc:
+        raise SystemExit(f"Cannot query server at {args.socket}: {exc}")
+    if "error" in response:
+        raise SystemExit(response["error"])
+    for rank, item in enumerate(response.get("results", []), start=1):
+        if args.format == "jsonl":
+            line = json.dumps({"rank": rank, **item}, ensure_ascii=False)
+        else:
+            line = format_result(rank, item)
+        sys.stdout.write(line + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
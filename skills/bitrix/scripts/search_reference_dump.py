@@ -4,35 +4,507 @@
 from __future__ import annotations
 
 import argparse
+import bisect
+import codecs
+import itertools
+import hashlib
+import heapq
 import json
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Iterable, Iterator
+import math
+import mmap
+import os
+import re
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+from fnmatch import fnmatchcase
+from functools import cached_property, lru_cache, partial
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Iterable, Iterator, TypeVar
 
 
 TEXT_EXTENSIONS = {".md", ".txt"}
 JSON_EXTENSIONS = {".json", ".jsonl"}
+MMAP_EXTENSIONS = TEXT_EXTENSIONS | {".jsonl"}
+
+# .json files at or above this size are parsed incrementally, one top-level item at a time.
+STREAM_JSON_MIN_BYTES = 64 * 1024 * 1024
+STREAM_CHUNK_CHARS = 1 << 20
+STREAM_JSON_MAX_ITEM_CHARS = 256 * 1024 * 1024
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+INDEX_DIR_NAME = ".search-index"
+INDEX_FILE_NAME = "index.bin"
+LEGACY_INDEX_FILE_NAMES = ("index.json",)
+# <index dir>/query-cache/<corpus fingerprint>/<key hash>.entry, least recently used evicted first.
+QUERY_CACHE_DIR_NAME = "query-cache"
+QUERY_CACHE_DEFAULT_ENTRIES = 256
+# Bump when the fields of cached results change.
+QUERY_CACHE_VERSION = 2
+INDEX_FORMAT_VERSION = 9
+INDEX_MAGIC = b"BXSIDX\x00\x00"
+# Sections of index.bin, in file order. Offsets are 8-byte aligned.
+INDEX_SECTIONS = (
+    "meta",  # JSON: format/tokenizer versions and corpus totals
+    "files",  # JSON: source file manifest, only read on refresh
+    "file_docs",  # JSON: [file key, first doc id, end doc id] runs, in doc id order
+    "doc_lengths",  # uint32 pairs: title length, content length
+    "doc_offsets",  # uint64 offsets into doc_data, doc_count + 1 entries
+    # per doc, each varint length-prefixed: file key, source suffix after the file path,
+    # snippet checkpoint positions and text byte offsets (varint deltas); varint text offset and
+    # byte length in the text stream; varint length-prefixed --dedup MinHash (uint32s); then
+    # varint alias count and per alias its file key and source suffix
+    "doc_data",
+    "term_offsets",  # uint64 offsets into term_data, term_count + 1 entries
+    "term_data",  # UTF-8 terms sorted by bytes
+    "term_entries",  # per term: postings offset (uint64), byte length, doc freq (uint32)
+    "postings",  # per term blocks, see PostingsBuilder
+    "gram_offsets",  # uint64 offsets into gram_data, gram_count + 1 entries
+    "gram_data",  # UTF-8 trigrams of "^term$", sorted by bytes
+    "gram_term_offsets",  # uint64 offsets into gram_terms, gram_count + 1 entries
+    "gram_terms",  # per trigram: varint deltas of the ids of terms containing it
+    "text_block_offsets",  # uint64 offsets into text_blocks, block count + 1 entries
+    # zlib blocks of meta text_block_bytes each of the UTF-8 doc texts, back to back; after a
+    # refresh the stream may still hold texts of dropped docs, until it is compacted
+    "text_blocks",
+)
+INDEX_HEADER = struct.Struct("<8sII")
+INDEX_SECTION_ENTRY = struct.Struct("<QQ")
+TERM_ENTRY = struct.Struct("<QII")
+POSTINGS_HEADER = struct.Struct("<I4s")
+# Key and value length of a record in a spilled run.
+RUN_RECORD = struct.Struct("<II")
+# Bump whenever tokenize() output changes: existing indexes are then rebuilt from scratch.
+TOKENIZER_VERSION = 2
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Text with a letter or digit always yields a token; text without one may not (a bare "__").
+ALNUM_PATTERN = re.compile(r"[^\W_]")
+WORD_START_PATTERN = re.compile(r"(?<!\w)\w")
+NON_SPACE_PATTERN = re.compile(r"\S+")
+# Words the code-aware tokenizer splits: compounds (CIBlockElement::GetList, Bitrix\Main\Loader,
+# crm.deal.list, $this->getId), snake_case and camelCase. Anything else is a plain \w+ token.
+IDENTIFIER_PATTERN = re.compile(
+    r"(?<!\w)(?=\w[^\W_A-ZА-ЯЁ]*[_A-ZА-ЯЁ]|\w+(?:::|\\|\.|->)\w)"
+    r"\w+(?:(?:::|\\|\.|->)\w+)*"
+)
+# camelCase / PascalCase parts; an uppercase run keeps its last letter for the next part (CIBlock).
+CAMEL_PART_PATTERN = re.compile(
+    r"[A-ZА-ЯЁ]+(?=[A-ZА-ЯЁ][a-zа-яё])|[A-ZА-ЯЁ]?[a-zа-яё\d]+|[A-ZА-ЯЁ\d]+|[^\W_]+"
+)
+# field:value filter | quoted phrase | NEAR/k operator | bare chunk.
+QUERY_SYNTAX_PATTERN = re.compile(
+    r'(?<!\S)(title|path|ext):("[^"]*"?|[^"\s]+)|"([^"]*)"?|\bNEAR/(\d+)\b|([^"\s]+)'
+)
+MARKDOWN_TITLE_PATTERN = re.compile(r"^#{1,6}[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+MARKDOWN_TITLE_BYTES_PATTERN = re.compile(rb"^#{1,6}[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+
+# BM25F: per-field length normalization, then one saturation per term.
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 3.0
+CONTENT_WEIGHT = 1.0
+
+EXHAUSTED_DOC_ID = 1 << 62
+
+# Fuzzy expansion: shorter terms match too much of the vocabulary at any distance.
+FUZZY_MAX_DISTANCE = 2
+FUZZY_MIN_TERM_LENGTH = 4
+FUZZY_MAX_EXPANSIONS = 8
+
+# --dedup: MinHash over 3-token content shingles. A document whose estimated Jaccard similarity
+# to an indexed one reaches DEDUP_MIN_SIMILARITY is stored as its alias instead of being indexed.
+DEDUP_MIN_SIMILARITY = 0.9
+DEDUP_HASHES = 32
+# LSH: documents agreeing on every row of one band are compared (~99% recall at 0.9 similarity).
+DEDUP_BANDS = 4
+DEDUP_BAND_ROWS = 4
+UINT32_MASK = (1 << 32) - 1
+UINT64_MASK = (1 << 64) - 1
+
+# Snippets show the densest SNIPPET_SPAN_TOKENS-token run of query terms, with a short lead-in.
+SNIPPET_WIDTH = 240
+SNIPPET_SPAN_TOKENS = 24
+SNIPPET_LEAD_TOKENS = 6
+# Indexed documents keep (token position, byte offset) checkpoints at least this many chars apart,
+# so a snippet decodes a window of a few KB of the stored text instead of the whole document.
+SNIPPET_CHECKPOINT_CHARS = 512
+SNIPPET_READ_BYTES = 4096
+# Stored texts are concatenated and zlib-compressed in blocks of this many bytes; a snippet
+# inflates only the blocks its window overlaps.
+TEXT_BLOCK_BYTES = 16 * 1024
+TEXT_BLOCK_CACHE_SIZE = 8
+# An index build writes its buffered postings and gram lists to sorted runs in temporary files
+# once their estimated size passes this, and merges the runs when it finishes.
+INDEX_SPILL_BYTES = 32 * 1024 * 1024
+# Rough size of an empty postings builder and of an empty gram list, for the spill estimate.
+POSTINGS_BUILDER_BYTES = 512
+GRAM_LIST_BYTES = 160
+# --workers: files and bytes per task (a larger file goes alone), and tasks in flight per worker.
+WORKER_CHUNK_FILES = 16
+WORKER_CHUNK_BYTES = 1024 * 1024
+WORKER_PENDING_CHUNKS = 2
+# Files of this size or more are tokenized one document at a time in the main process, even with
+# --workers, so an index build never holds all of their tokens at once.
+TOKENIZE_INLINE_MIN_BYTES = 4 * 1024 * 1024
+
+# --stats phases: listing files or opening the index; reading and tokenizing documents or decoding
+# postings; BM25F scoring (with MaxScore top-k on the index); top-k selection and snippets.
+SEARCH_PHASES = ("discover", "parse", "score", "rank")
+
+T = TypeVar("T")
 
 
 @dataclass
 class Document:
     source: str
     content: str
+    title: str = ""
+
+
+@dataclass
+class Query:
+    # Every token of the query; all of them are BM25F-scored.
+    terms: list[str]
+    # Quoted phrases: (token, offset) pairs that must occur at consecutive positions in content.
+    phrases: list[list[tuple[str, int]]] = field(default_factory=list)
+    # (left operand, right operand, k): both occur with at most k tokens between them.
+    near: list[tuple[list[tuple[str, int]], list[tuple[str, int]], int]] = field(
+        default_factory=list
+    )
+    # Max edit distance for expanding terms against the index vocabulary (0 = exact only).
+    fuzzy: int = 0
+    # Score multipliers of fuzzy expansions; terms not listed weigh 1.0.
+    weights: dict[str, float] = field(default_factory=dict)
+    # title: operands; every token must occur in the title field.
+    title_terms: list[str] = field(default_factory=list)
+    # path: globs and ext: extensions; values of one kind are alternatives, kinds combine with AND.
+    paths: list[str] = field(default_factory=list)
+    extensions: list[str] = field(default_factory=list)
+
+    @cached_property
+    def required_terms(self) -> set[str]:
+        required = {term for phrase in self.phrases for term, _ in phrase}
+        for left, right, _ in self.near:
+            required.update(term for term, _ in left)
+            required.update(term for term, _ in right)
+        return required
+
+    @property
+    def scoped(self) -> bool:
+        return bool(self.paths or self.extensions)
+
+    def file_scope(self, file_key: str) -> bool | None:
+        # True: every document of the file is in scope, False: none is, None: depends on the
+        # item key of each document (.json dumps keyed by document path).
+        if self.extensions and PurePosixPath(file_key).suffix.lower() not in self.extensions:
+            return False
+        if not self.paths or any(path_matches(pattern, file_key) for pattern in self.paths):
+            return True
+        return None if file_key.lower().endswith(".json") else False
+
+    def item_in_scope(self, item_key: str) -> bool:
+        return any(path_matches(pattern, item_key) for pattern in self.paths)
+
+    def matches(self, positions_of: Callable[[str], list[int]]) -> bool:
+        for phrase in self.phrases:
+            if not phrase_spans(phrase, positions_of):
+                return False
+        for left, right, distance in self.near:
+            left_spans = phrase_spans(left, positions_of)
+            right_spans = phrase_spans(right, positions_of)
+            if not spans_within(left_spans, right_spans, distance):
+                return False
+        return True
+
+
+@dataclass
+class QueryBatch:
+    # Queries evaluated together in one pass over the corpus.
+    queries: list[Query]
+
+    @cached_property
+    def terms(self) -> set[str]:
+        return {term for query in self.queries for term in query.terms}
 
 
 @dataclass
 class Match:
     source: str
-    score: int
+    score: float
     snippet: str
+    # Sources of near-duplicates collapsed into this one by --build-index --dedup.
+    aliases: list[str] = field(default_factory=list)
+    # (token position, term) of the query-term hits shown in the snippet.
+    offsets: list[tuple[int, str]] = field(default_factory=list)
+
+
+@dataclass
+class CorpusStats:
+    doc_count: int = 0
+    title_length_total: int = 0
+    content_length_total: int = 0
+
+    def add(self, title_length: int, content_length: int) -> None:
+        self.doc_count += 1
+        self.title_length_total += title_length
+        self.content_length_total += content_length
+
+    def merge(self, other: CorpusStats) -> None:
+        self.doc_count += other.doc_count
+        self.title_length_total += other.title_length_total
+        self.content_length_total += other.content_length_total
+
+    @property
+    def avg_title_length(self) -> float:
+        return self.title_length_total / self.doc_count if self.doc_count else 0.0
+
+    @property
+    def avg_content_length(self) -> float:
+        return self.content_length_total / self.doc_count if self.doc_count else 0.0
+
+
+@dataclass
+class FileScan:
+    path: Path
+    size: int
+    stats: CorpusStats
+    # Per batch query: (source, title_length, content_length, {term: (title_tf, content_tf)})
+    # of matching docs.
+    candidates: list[list[tuple[str, int, int, dict[str, tuple[int, int]]]]]
+    # Per batch query: term document frequencies, including docs rejected by phrase/NEAR.
+    doc_freq: list[Counter]
+    # Per batch query: Query.file_scope() of this file.
+    scopes: list[bool | None]
+    # Per batch query: stats of the in-scope documents when the scope is decided per item.
+    item_stats: list[CorpusStats]
+
+    @classmethod
+    def empty(cls, path: Path, batch: QueryBatch, file_key: str = "") -> FileScan:
+        return cls(
+            path=path,
+            size=file_size(path),
+            stats=CorpusStats(),
+            candidates=[[] for _ in batch.queries],
+            doc_freq=[Counter() for _ in batch.queries],
+            scopes=[query.file_scope(file_key) for query in batch.queries],
+            item_stats=[CorpusStats() for _ in batch.queries],
+        )
+
+
+@dataclass
+class TokenizedDocument:
+    source: str
+    text: str
+    title_counts: dict[str, int]
+    length: int
+    positions: dict[str, list[int]]
+    # (token position, byte offset in text) snippet checkpoints.
+    checkpoints: list[tuple[int, int]]
+    # Content MinHash signature, only computed for --dedup builds.
+    minhash: tuple[int, ...] = ()
+
+
+@dataclass
+class FileTokens:
+    path: Path
+    size: int
+    docs: Iterable[TokenizedDocument] | None
+
+
+@dataclass
+class Throughput:
+    docs: int = 0
+    size: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    finished: float | None = None
+
+    def add(self, docs: int, size: int) -> None:
+        self.docs += docs
+        self.size += size
+
+    def summary(self) -> str:
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        elapsed = max(finished - self.started, 1e-9)
+        megabytes = self.size / (1024 * 1024)
+        return (
+            f"Processed {self.docs} documents, {megabytes:.1f} MB in {elapsed:.2f}s "
+            f"({self.docs / elapsed:.0f} docs/s, {megabytes / elapsed:.1f} MB/s)"
+        )
+
+
+@dataclass
+class SearchTimings:
+    seconds: dict[str, float] = field(default_factory=lambda: dict.fromkeys(SEARCH_PHASES, 0.0))
+    started: float = field(default_factory=time.perf_counter)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+
+    def to_dict(self, mode: str, results: int) -> dict:
+        stats: dict = {"mode": mode, "results": results}
+        for name, seconds in self.seconds.items():
+            stats[f"{name}_ms"] = round(seconds * 1000, 3)
+        stats["total_ms"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return stats
+
+    def summary(self, mode: str, results: int) -> str:
+        phases = ", ".join(
+            f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.seconds.items()
+        )
+        total = (time.perf_counter() - self.started) * 1000
+        return f"Stats ({mode}, {results} results): {phases}, total {total:.1f} ms"
+
+
+def timed(timings: SearchTimings | None, phase: str):
+    return timings.phase(phase) if timings is not None else nullcontext()
+
+
+@dataclass
+class PostingList:
+    doc_ids: list[int]
+    title_tfs: array
+    content_tfs: array
+    # Cumulative end offsets of each doc's varint position deltas in positions_blob.
+    position_ends: array
+    positions_blob: bytes
+
+    def positions(self, index: int) -> list[int]:
+        start = self.position_ends[index - 1] if index else 0
+        return decode_varint_deltas(self.positions_blob, start, self.position_ends[index])
+
+
+@dataclass
+class TermCursor:
+    term: str
+    postings: PostingList
+    idf: float
+    position: int = 0
+
+    @property
+    def doc_id(self) -> int:
+        if self.position < len(self.postings.doc_ids):
+            return self.postings.doc_ids[self.position]
+        return EXHAUSTED_DOC_ID
+
+    def seek(self, target: int) -> None:
+        # Binary search for the first posting with doc_id >= target.
+        low, high = self.position, len(self.postings.doc_ids)
+        doc_ids = self.postings.doc_ids
+        while low < high:
+            middle = (low + high) // 2
+            if doc_ids[middle] < target:
+                low = middle + 1
+            else:
+                high = middle
+        self.position = low
+
+
+@dataclass
+class DocScope:
+    # Sorted, disjoint [start, end) doc id ranges that a path:/ext: filtered query may return.
+    starts: list[int] = field(default_factory=list)
+    ends: list[int] = field(default_factory=list)
+
+    def add(self, start: int, end: int) -> None:
+        if self.ends and self.ends[-1] == start:
+            self.ends[-1] = end
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+
+    @property
+    def doc_count(self) -> int:
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def next_doc(self, doc_id: int) -> int:
+        # First in-scope doc id >= doc_id.
+        position = bisect.bisect_right(self.starts, doc_id) - 1
+        if position >= 0 and doc_id < self.ends[position]:
+            return doc_id
+        if position + 1 < len(self.starts):
+            return self.starts[position + 1]
+        return EXHAUSTED_DOC_ID
+
+    def count(self, doc_ids: list[int]) -> int:
+        if len(self.starts) < len(doc_ids):
+            return sum(
+                bisect.bisect_left(doc_ids, end) - bisect.bisect_left(doc_ids, start)
+                for start, end in zip(self.starts, self.ends)
+            )
+        return sum(1 for doc_id in doc_ids if self.next_doc(doc_id) == doc_id)
+
+
+class DescendingText(str):
+    """String with reversed ordering, so heap entries tie-break on ascending source."""
+
+    def __lt__(self, other: str) -> bool:
+        return str.__gt__(self, other)
+
+    def __gt__(self, other: str) -> bool:
+        return str.__lt__(self, other)
+
+
+@dataclass
+class DocLayout:
+    # Offsets of one document's record fields in the doc_data section.
+    start: int
+    text_field: int  # varint text offset and byte length
+    text_offset: int
+    text_size: int
+    minhash: int  # varint length-prefixed MinHash
+    aliases: int  # varint alias count and the aliases
+
+
+@dataclass
+class IndexRefresh:
+    added: int = 0
+    changed: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    full_rebuild: bool = False
+    dedup: bool = False
+    # Totals of the written index; `carried` documents were copied from the previous one.
+    docs: int = 0
+    terms: int = 0
+    aliases: int = 0
+    carried: int = 0
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Search external Bitrix docs dumps and return ranked matches."
     )
-    parser.add_argument("--root", required=True, help="Root directory with docs dump.")
-    parser.add_argument("--query", required=True, help="Search query.")
+    parser.add_argument(
+        "--root",
+        default=None,
+        help="Root directory with docs dump. Required unless --connect is used.",
+    )
+    parser.add_argument(
+        "--query",
+        default=None,
+        help=(
+            'Search query. "quoted phrase" requires consecutive tokens; '
+            "a NEAR/k b requires a and b within k tokens of each other; "
+            "title:word, path:<glob> and ext:<ext> restrict the documents searched."
+        ),
+    )
     parser.add_argument(
         "--limit",
         type=int,
@@ -41,42 +513,402 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument(
         "--min-score",
+        type=float,
+        default=0.0,
+        help="Minimum BM25 score threshold (any matching document scores above 0). Default: 0",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", "jsonl"),
+        default="text",
+        help=(
+            "Output of --query/--connect results. jsonl writes one JSON object per result "
+            '(rank, source, score, snippet, "offsets" as [token position, term] query-term hits '
+            "shown in the snippet, aliases), each flushed as soon as its rank is final. "
+            "Default: text"
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help=(
+            "With --query: report wall time per phase (discover, parse, score, rank). Written "
+            'to stderr, or as a final {"stats": ...} line with --format jsonl.'
+        ),
+    )
+    parser.add_argument(
+        "--fuzzy",
+        type=int,
+        default=None,
+        choices=range(FUZZY_MAX_DISTANCE + 1),
+        metavar="K",
+        help=(
+            f"Also match index terms within edit distance K (0-{FUZZY_MAX_DISTANCE}) of query "
+            f"terms of {FUZZY_MIN_TERM_LENGTH}+ chars, ranked below exact hits. Without an "
+            "index on disk one is built in memory. Default: 0 (with --connect: the server's "
+            "--fuzzy)"
+        ),
+    )
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help=(
+            "Build or refresh on-disk inverted index for --root and exit "
+            "(or run --query against it when given). Only added/changed files are re-tokenized."
+        ),
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=None,
+        help=f"Index directory. Default: <root>/{INDEX_DIR_NAME}",
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help="Ignore existing index and scan raw dump files.",
+    )
+    parser.add_argument(
+        "--dedup",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "With --build-index: store near-duplicate documents (MinHash similarity >= "
+            f"{DEDUP_MIN_SIMILARITY}) as aliases of the first indexed copy instead of indexing "
+            "them. Changing the setting rebuilds the index; when omitted, the existing index "
+            "keeps its setting."
+        ),
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help=(
+            "Raw scan only: memory-map .md/.txt/.jsonl files and decode only documents/lines "
+            "whose bytes match a query term. Length normalization then uses byte sizes."
+        ),
+    )
+    parser.add_argument(
+        "--queries-file",
+        default=None,
+        help=(
+            'JSON lines of {"query": ..., "limit": ..., "min_score": ..., "id": ...}; "-" reads '
+            "stdin. All queries are answered in one pass over the dump (or one index load); "
+            "one JSON result line is written per input line."
+        ),
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Load the index once (or build it in memory when --root has none) and answer "
+            "JSON-lines queries on stdin/stdout, or on --socket when given."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        default=None,
+        help="Unix socket path for --serve.",
+    )
+    parser.add_argument(
+        "--connect",
+        default=None,
+        help=(
+            "Send --query to a running --serve --socket server at this path and print results. "
+            "search_reference_client.py does the same without loading this module."
+        ),
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=QUERY_CACHE_DEFAULT_ENTRIES,
+        help=(
+            "Max cached --query results kept under <index dir>/query-cache; entries are "
+            "dropped when the index or dump files change. 0 disables the cache. "
+            f"Default: {QUERY_CACHE_DEFAULT_ENTRIES}"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
         type=int,
         default=1,
-        help="Minimum score threshold. Default: 1",
+        help=(
+            "Worker processes for parsing/tokenizing dump files (scan and --build-index). "
+            "0 = all CPUs. Default: 1"
+        ),
     )
     return parser.parse_args()
 
 
-def normalize(text: str) -> str:
-    return " ".join(text.lower().split())
+def parse_query(text: str, fuzzy: int = 0) -> Query:
+    # Operands are quoted phrases or bare chunks (a chunk like crm.deal.list that splits into
+    # several tokens acts as a phrase when it is a NEAR operand).
+    items: list[tuple[list[tuple[str, int]], bool] | int] = []
+    query = Query(terms=[], fuzzy=fuzzy)
+    for found in QUERY_SYNTAX_PATTERN.finditer(text):
+        name, value, phrase, distance, chunk = found.groups()
+        if name is not None:
+            value = value.strip('"')
+            if name == "title":
+                query.title_terms.extend(tokenize(value))
+            elif name == "path" and value:
+                query.paths.append(value)
+            elif name == "ext" and value.strip("."):
+                query.extensions.append("." + value.strip(".").lower())
+        elif distance is not None:
+            items.append(int(distance))
+        elif phrase is not None:
+            tokens = list(zip(*tokenize_positions(phrase)))
+            if tokens:
+                items.append((tokens, True))
+        else:
+            tokens = list(zip(*tokenize_positions(chunk)))
+            if tokens:
+                items.append((tokens, False))
+
+    query.title_terms = sorted(set(query.title_terms))
+    terms: set[str] = set(query.title_terms)
+    near_operands: set[int] = set()
+    for position, item in enumerate(items):
+        if isinstance(item, int):
+            continue
+        terms.update(term for term, _ in item[0])
+        if (
+            position + 2 < len(items)
+            and isinstance(items[position + 1], int)
+            and not isinstance(items[position + 2], int)
+        ):
+            query.near.append((item[0], items[position + 2][0], items[position + 1]))
+            near_operands.update((position, position + 2))
+
+    for position, item in enumerate(items):
+        if isinstance(item, tuple) and item[1] and position not in near_operands:
+            query.phrases.append(item[0])
+    query.terms = sorted(terms)
+    return query
+
+
+def path_matches(pattern: str, key: str) -> bool:
+    # A pattern without wildcards also matches everything below it (path:rest/crm).
+    return fnmatchcase(key, pattern) or fnmatchcase(key, pattern.rstrip("/") + "/*")
+
+
+def phrase_spans(
+    phrase: list[tuple[str, int]], positions_of: Callable[[str], list[int]]
+) -> list[tuple[int, int]]:
+    first, first_offset = phrase[0]
+    starts = {position - first_offset for position in positions_of(first)}
+    for term, offset in phrase[1:]:
+        if not starts:
+            break
+        starts &= {position - offset for position in positions_of(term)}
+    width = max(offset for _, offset in phrase)
+    return [(start, start + width) for start in sorted(starts)]
 
 
-def query_terms(query: str) -> list[str]:
-    terms = [token for token in normalize(query).split(" ") if token]
-    return sorted(set(terms))
+def spans_within(left: list[tuple[int, int]], right: list[tuple[int, int]], distance: int) -> bool:
+    # Gap of at most `distance` tokens between the spans, in either order.
+    right_starts = [start for start, _ in right]
+    right_ends = sorted(end for _, end in right)
+    for start, end in left:
+        after = bisect.bisect_left(right_starts, end + 1)
+        if after < len(right_starts) and right_starts[after] <= end + 1 + distance:
+            return True
+        before = bisect.bisect_right(right_ends, start - 1)
+        if before and right_ends[before - 1] >= start - 1 - distance:
+            return True
+    return False
 
 
-def iter_documents(root: Path) -> Iterator[Document]:
+def tokenize(text: str) -> list[str]:
+    return tokenize_positions(text)[0]
+
+
+def tokenize_positions(
+    text: str,
+    checkpoints: list[tuple[int, int]] | None = None,
+    spacing: int = SNIPPET_CHECKPOINT_CHARS,
+) -> tuple[list[str], list[int]]:
+    # Word parts (GetList -> get, list; UF_NAME -> uf, name) take consecutive positions; the
+    # whole word and the whole compound (ciblockelement::getlist) are extra tokens sharing the
+    # position of their first part, so phrases over either form line up.
+    # With `checkpoints`, (position, char offset) pairs of word/identifier starts at least
+    # `spacing` chars apart are collected; tokenizing text[offset:] reproduces the positions
+    # from there on, offset by the checkpoint position.
+    tokens: list[str] = []
+    positions: list[int] = []
+    position = 0
+    last = 0
+    due = 0 if checkpoints is not None else len(text) + 1
+    for found in IDENTIFIER_PATTERN.finditer(text):
+        start = found.start()
+        if due < start:
+            due = add_span_checkpoints(text, last, start, position, due, spacing, checkpoints)
+        words = TOKEN_PATTERN.findall(text[last:start].lower())
+        tokens.extend(words)
+        positions.extend(range(position, position + len(words)))
+        position += len(words)
+        last = found.end()
+        if due <= start:
+            checkpoints.append((position, start))
+            due = start + max(spacing, 1)
+
+        raw = found.group()
+        words = TOKEN_PATTERN.findall(raw)
+        compound_start = position
+        for word in words:
+            if "_" not in word and (word.islower() or word[1:].islower() or word.isupper()):
+                tokens.append(word.lower())
+                positions.append(position)
+                position += 1
+                continue
+            word_start = position
+            parts = [part for piece in word.split("_") for part in CAMEL_PART_PATTERN.findall(piece)]
+            for part in parts:
+                tokens.append(part.lower())
+                positions.append(position)
+                position += 1
+            if len(parts) > 1:
+                tokens.append(word.lower())
+                positions.append(word_start)
+        if len(words) > 1 and position > compound_start:
+            tokens.append(raw.lower())
+            positions.append(compound_start)
+    if due < len(text):
+        add_span_checkpoints(text, last, len(text), position, due, spacing, checkpoints)
+    words = TOKEN_PATTERN.findall(text[last:].lower())
+    tokens.extend(words)
+    positions.extend(range(position, position + len(words)))
+    return tokens, positions
+
+
+def token_spans(text: str) -> Iterator[tuple[str, int, int]]:
+    # (token, start, end) of every token tokenize_positions() emits, split at the same
+    # boundaries: plain words, word parts, whole words and whole compounds.
+    last = 0
+    for found in IDENTIFIER_PATTERN.finditer(text):
+        for word in TOKEN_PATTERN.finditer(text, last, found.start()):
+            yield word.group().lower(), word.start(), word.end()
+        last = found.end()
+
+        words = list(TOKEN_PATTERN.finditer(text, found.start(), found.end()))
+        emitted = False
+        for word in words:
+            value = word.group()
+            if "_" not in value and (value.islower() or value[1:].islower() or value.isupper()):
+                yield value.lower(), word.start(), word.end()
+                emitted = True
+                continue
+            parts: list[re.Match[str]] = []
+            piece_start = word.start()
+            for piece in value.split("_"):
+                parts.extend(
+                    CAMEL_PART_PATTERN.finditer(text, piece_start, piece_start + len(piece))
+                )
+                piece_start += len(piece) + 1
+            for part in parts:
+                yield part.group().lower(), part.start(), part.end()
+            if len(parts) > 1:
+                yield value.lower(), word.start(), word.end()
+            emitted = emitted or bool(parts)
+        if len(words) > 1 and emitted:
+            yield found.group().lower(), found.start(), found.end()
+    for word in TOKEN_PATTERN.finditer(text, last):
+        yield word.group().lower(), word.start(), word.end()
+
+
+def add_span_checkpoints(
+    text: str,
+    start: int,
+    end: int,
+    position: int,
+    due: int,
+    spacing: int,
+    checkpoints: list[tuple[int, int]],
+) -> int:
+    # Checkpoints inside a run of plain words; `position` is the position of the run's first word.
+    while due < end:
+        word = WORD_START_PATTERN.search(text, max(due, start), end)
+        if word is None:
+            break
+        position += len(TOKEN_PATTERN.findall(text[start:word.start()].lower()))
+        start = word.start()
+        checkpoints.append((position, start))
+        due = start + max(spacing, 1)
+    return due
+
+
+def iter_source_files(root: Path) -> Iterator[Path]:
     for path in root.rglob("*"):
         if not path.is_file():
             continue
         if path.name.startswith("."):
             continue
-
-        suffix = path.suffix.lower()
-        if suffix in TEXT_EXTENSIONS:
-            content = read_text_safe(path)
-            if content:
-                yield Document(source=str(path), content=content)
+        if INDEX_DIR_NAME in path.relative_to(root).parts:
             continue
+        if path.suffix.lower() in TEXT_EXTENSIONS | JSON_EXTENSIONS:
+            yield path
 
-        if suffix == ".json":
-            yield from iter_json_documents(path)
-            continue
 
-        if suffix == ".jsonl":
-            yield from iter_jsonl_documents(path)
+def iter_file_documents(path: Path) -> Iterator[Document]:
+    suffix = path.suffix.lower()
+    if suffix in TEXT_EXTENSIONS:
+        content = read_text_safe(path)
+        if content:
+            title = ""
+            if suffix == ".md":
+                heading = MARKDOWN_TITLE_PATTERN.search(content)
+                title = heading.group(1) if heading else ""
+            yield Document(source=str(path), content=content, title=title)
+        return
+
+    if suffix == ".json":
+        yield from iter_json_documents(path)
+        return
+
+    if suffix == ".jsonl":
+        yield from iter_jsonl_documents(path)
+
+
+def map_source_files(func: Callable[[Path], T], paths: list[Path], workers: int) -> Iterator[T]:
+    # Chunks are collected in submission order, so merged output matches the serial path. Only
+    # a few chunks per worker are in flight, so results the caller has not consumed yet stay
+    # bounded.
+    if workers <= 1 or len(paths) < 2:
+        yield from map(func, paths)
+        return
+    max_files = max(1, min(WORKER_CHUNK_FILES, len(paths) // (workers * 8)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight: deque = deque()
+        for chunk in source_file_chunks(paths, max_files):
+            in_flight.append(executor.submit(map_chunk, func, chunk))
+            if len(in_flight) >= workers * WORKER_PENDING_CHUNKS:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def source_file_chunks(paths: list[Path], max_files: int) -> Iterator[list[Path]]:
+    chunk: list[Path] = []
+    chunk_size = 0
+    for path in paths:
+        size = file_size(path)
+        if chunk and (len(chunk) >= max_files or chunk_size + size > WORKER_CHUNK_BYTES):
+            yield chunk
+            chunk, chunk_size = [], 0
+        chunk.append(path)
+        chunk_size += size
+    if chunk:
+        yield chunk
+
+
+def map_chunk(func: Callable[[Path], T], paths: list[Path]) -> list[T]:
+    return [func(path) for path in paths]
+
+
+def file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
 
 
 def read_text_safe(path: Path) -> str:
@@ -87,6 +919,26 @@ def read_text_safe(path: Path) -> str:
 
 
 def iter_json_documents(path: Path) -> Iterator[Document]:
+    if file_size(path) >= STREAM_JSON_MIN_BYTES:
+        items = iter_json_stream_items(path)
+    else:
+        items = iter_json_loaded_items(path)
+
+    for key, value in items:
+        if isinstance(key, str):
+            # Known format in Bitrix dumps: {"<doc-path>": {"content": "..."}}
+            if isinstance(value, dict) and isinstance(value.get("content"), str):
+                source = f"{path}::{key}"
+                yield Document(source=source, content=value["content"], title=extract_json_title(value))
+            continue
+
+        content = extract_json_text(value)
+        if content:
+            source = f"{path}::[{key}]"
+            yield Document(source=source, content=content, title=extract_json_title(value))
+
+
+def iter_json_loaded_items(path: Path) -> Iterator[tuple[str | int, object]]:
     raw = read_text_safe(path)
     if not raw:
         return
@@ -97,19 +949,116 @@ def iter_json_documents(path: Path) -> Iterator[Document]:
         return
 
     if isinstance(data, dict):
-        # Known format in Bitrix dumps: {"<doc-path>": {"content": "..."}}
-        for key, value in data.items():
-            if isinstance(value, dict) and isinstance(value.get("content"), str):
-                source = f"{path}::{key}"
-                yield Document(source=source, content=value["content"])
+        yield from data.items()
+    elif isinstance(data, list):
+        yield from enumerate(data)
+
+
+def iter_json_stream_items(path: Path) -> Iterator[tuple[str | int, object]]:
+    """Yield (key, value) of a top-level object or (index, item) of a top-level array.
+
+    Memory is bounded by the largest single item, not by the file size. Parsing stops
+    silently at the first malformed item; items before it are still yielded.
+    """
+    try:
+        handle = path.open("rb")
+    except OSError:
+        return
+
+    with handle:
+        try:
+            yield from iter_json_stream_reader_items(JsonStreamReader(handle))
+        except (JsonStreamError, OSError):
+            return
+
+
+def iter_json_stream_reader_items(reader: JsonStreamReader) -> Iterator[tuple[str | int, object]]:
+    opening = reader.next_char()
+    if opening == "\ufeff":
+        opening = reader.next_char()
+    if opening not in ("{", "["):
+        return
+
+    closing = "}" if opening == "{" else "]"
+    if reader.peek_char() == closing:
         return
 
-    if isinstance(data, list):
-        for index, item in enumerate(data):
-            content = extract_json_text(item)
-            if content:
-                source = f"{path}::[{index}]"
-                yield Document(source=source, content=content)
+    index = 0
+    while True:
+        if opening == "{":
+            key = reader.decode_value()
+            if not isinstance(key, str) or reader.next_char() != ":":
+                return
+            yield key, reader.decode_value()
+        else:
+            yield index, reader.decode_value()
+            index += 1
+
+        separator = reader.next_char()
+        if separator != ",":
+            return
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class JsonStreamReader:
+    def __init__(self, handle) -> None:
+        self.handle = handle
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.decoder_json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_chars: int) -> bool:
+        # Compact consumed prefix only when reading, so per-item cost stays O(item).
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        while len(self.buffer) < min_chars and not self.eof:
+            chunk = self.handle.read(STREAM_CHUNK_CHARS)
+            self.eof = not chunk
+            self.buffer += self.decoder.decode(chunk, final=self.eof)
+        return True
+
+    def skip_whitespace(self) -> None:
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill(STREAM_CHUNK_CHARS):
+                return
+
+    def peek_char(self) -> str:
+        self.skip_whitespace()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def next_char(self) -> str:
+        char = self.peek_char()
+        self.pos += len(char)
+        return char
+
+    def decode_value(self) -> object:
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder_json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                value, end = None, -1
+            # A number may continue past the buffer edge ("1." of "1.5"), so it is only
+            # final when followed by a char that cannot extend it.
+            if end != -1 and (
+                self.eof
+                or (end < len(self.buffer) and self.buffer[end] not in JSON_NUMBER_CHARS)
+            ):
+                self.pos = end
+                return value
+            pending = len(self.buffer) - self.pos
+            if self.eof or pending > STREAM_JSON_MAX_ITEM_CHARS:
+                raise JsonStreamError(f"Malformed or oversized JSON item at char {self.pos}.")
+            # Grow geometrically so re-decoding a large item stays amortized linear.
+            self.fill(2 * pending + STREAM_CHUNK_CHARS)
 
 
 def iter_jsonl_documents(path: Path) -> Iterator[Document]:
@@ -126,7 +1075,7 @@ def iter_jsonl_documents(path: Path) -> Iterator[Document]:
                 content = extract_json_text(item)
                 if content:
                     source = f"{path}::line:{index + 1}"
-                    yield Document(source=source, content=content)
+                    yield Document(source=source, content=content, title=extract_json_title(item))
     except OSError:
         return
 
@@ -144,65 +1093,2391 @@ def extract_json_text(item: object) -> str:
     return ""
 
 
-def score_document(content: str, terms: list[str]) -> tuple[int, int]:
-    normalized = normalize(content)
-    if not normalized:
-        return 0, -1
+def extract_json_title(item: object) -> str:
+    if isinstance(item, dict) and isinstance(item.get("title"), str):
+        return item["title"]
+    return ""
+
+
+def bm25_idf(doc_count: int, doc_freq: int) -> float:
+    return math.log(1.0 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
 
-    score = 0
-    first_pos = -1
+def bm25f_term_score(
+    idf: float,
+    title_tf: int,
+    content_tf: int,
+    title_length: int,
+    content_length: int,
+    stats: CorpusStats,
+) -> float:
+    weighted = 0.0
+    if title_tf:
+        norm = 1.0 - BM25_B + BM25_B * title_length / (stats.avg_title_length or 1.0)
+        weighted += TITLE_WEIGHT * title_tf / norm
+    if content_tf:
+        norm = 1.0 - BM25_B + BM25_B * content_length / (stats.avg_content_length or 1.0)
+        weighted += CONTENT_WEIGHT * content_tf / norm
+    return idf * weighted / (BM25_K1 + weighted)
+
+
+def passage_start(hits: list[tuple[int, str]]) -> int:
+    # Token position where the snippet starts: a short lead-in before the window of
+    # SNIPPET_SPAN_TOKENS tokens with the most distinct query terms (then most hits, earliest).
+    hits = sorted(hits)
+    best = (0, 0)
+    start = 0
+    window: Counter = Counter()
+    right = 0
+    for left, (position, _) in enumerate(hits):
+        while right < len(hits) and hits[right][0] < position + SNIPPET_SPAN_TOKENS:
+            window[hits[right][1]] += 1
+            right += 1
+        if (len(window), right - left) > best:
+            best = (len(window), right - left)
+            start = position
+        window[hits[left][1]] -= 1
+        if not window[hits[left][1]]:
+            del window[hits[left][1]]
+    return max(start - SNIPPET_LEAD_TOKENS, 0)
+
+
+def snippet_hits(
+    hits: list[tuple[int, str]], position: int, shown: str
+) -> list[tuple[int, str]]:
+    # Hits among the tokens of the snippet text `shown`, which starts at token `position`;
+    # a word that may have been cut off at SNIPPET_WIDTH does not count.
+    if len(shown) >= SNIPPET_WIDTH:
+        shown = shown.rpartition(" ")[0]
+    _, positions = tokenize_positions(shown)
+    end = position + (positions[-1] + 1 if positions else 0)
+    return sorted(hit for hit in hits if position <= hit[0] < end)
+
+
+def word_at(starts: list[tuple[int, int]], position: int) -> int:
+    # Index into (position, char offset) word starts of the word holding token `position`.
+    return bisect.bisect_right(starts, (position, math.inf)) - 1
+
+
+def compact_window(text: str, offset: int, width: int = SNIPPET_WIDTH) -> str:
+    # Same as " ".join(text[offset:].split())[:width] without copying the rest of the text.
+    pieces: list[str] = []
+    size = -1
+    for found in NON_SPACE_PATTERN.finditer(text, offset):
+        pieces.append(found.group())
+        size += len(found.group()) + 1
+        if size >= width:
+            break
+    return " ".join(pieces)[:width]
+
+
+def highlight_terms(snippet: str, terms: list[str]) -> str:
+    # Marks the snippet spans of tokens that are query terms, so word parts highlight like they
+    # match (list -> Get**List**); of overlapping spans the earliest, then longest, wins.
+    wanted = set(terms)
+    if not wanted:
+        return snippet
+    spans = sorted((start, -end) for token, start, end in token_spans(snippet) if token in wanted)
+    pieces: list[str] = []
+    last = 0
+    for start, negative_end in spans:
+        if start < last:
+            continue
+        pieces.extend((snippet[last:start], "**", snippet[start:-negative_end], "**"))
+        last = -negative_end
+    pieces.append(snippet[last:])
+    return "".join(pieces)
+
+
+def text_snippet(content: str, terms: list[str]) -> tuple[str, list[tuple[int, str]]]:
+    # Raw-scan snippet and its hits: positions come from tokenizing the loaded document, only
+    # the passage itself is whitespace-collapsed.
+    wanted = set(terms)
+    starts: list[tuple[int, int]] = []
+    tokens, positions = tokenize_positions(content, starts, spacing=0)
+    hits = [(position, token) for token, position in zip(tokens, positions) if token in wanted]
+    start = passage_start(hits)
+    position = offset = 0
+    if start:
+        position, offset = starts[word_at(starts, start)]
+    shown = compact_window(content, offset)
+    return highlight_terms(shown, terms), snippet_hits(hits, position, shown)
+
+
+def scan_file(path: Path, batch: QueryBatch, root: Path, use_mmap: bool = False) -> FileScan:
+    file_key = path.relative_to(root).as_posix()
+    if use_mmap and path.suffix.lower() in MMAP_EXTENSIONS:
+        return scan_file_mmap(path, batch, file_key)
+
+    result = FileScan.empty(path, batch, file_key)
+    for doc in iter_file_documents(path):
+        if use_mmap:
+            add_scanned_document(
+                result,
+                doc,
+                batch,
+                title_length=len(doc.title.encode("utf-8")),
+                content_length=len(doc.content.encode("utf-8")),
+            )
+        else:
+            add_scanned_document(result, doc, batch)
+    return result
+
+
+def add_scanned_document(
+    result: FileScan,
+    doc: Document,
+    batch: QueryBatch,
+    title_length: int | None = None,
+    content_length: int | None = None,
+) -> None:
+    active = document_scopes(result, doc, batch)
+    if active is None:
+        return
+
+    content_tokens, content_positions = tokenize_positions(doc.content)
+    if not content_tokens:
+        return
+    title_tokens = tokenize(doc.title)
+    if title_length is None:
+        title_length = len(title_tokens)
+    if content_length is None:
+        content_length = len(content_tokens)
+    add_document_stats(result, active, title_length, content_length)
+
+    term_set = batch.terms
+    content_counts = Counter(token for token in content_tokens if token in term_set)
+    title_counts = Counter(token for token in title_tokens if token in term_set)
+    if not content_counts and not title_counts:
+        return
+    positions: dict[str, list[int]] | None = None
+    for query_index, query in enumerate(batch.queries):
+        if not active[query_index]:
+            continue
+        matched = [term for term in query.terms if content_counts[term] or title_counts[term]]
+        if not matched:
+            continue
+        result.doc_freq[query_index].update(matched)
+        if any(not title_counts[term] for term in query.title_terms):
+            continue
+        required = query.required_terms
+        if required:
+            if any(not content_counts[term] for term in required):
+                continue
+            if positions is None:
+                positions = {}
+                for token, position in zip(content_tokens, content_positions):
+                    if token in term_set:
+                        positions.setdefault(token, []).append(position)
+            if not query.matches(lambda term: positions.get(term, [])):
+                continue
+        freqs = {term: (title_counts[term], content_counts[term]) for term in matched}
+        result.candidates[query_index].append((doc.source, title_length, content_length, freqs))
+
+
+def document_scopes(result: FileScan, doc: Document, batch: QueryBatch) -> list[bool] | None:
+    active = result.scopes
+    if None in active:
+        item_key = doc.source[len(str(result.path)) + 2:]
+        active = [
+            scope if scope is not None else batch.queries[query_index].item_in_scope(item_key)
+            for query_index, scope in enumerate(active)
+        ]
+        if not any(active):
+            # Out of every query's scope: not tokenized, not part of any corpus statistics.
+            return None
+    return active
+
+
+def add_document_stats(
+    result: FileScan,
+    active: list[bool],
+    title_length: int,
+    content_length: int,
+) -> None:
+    result.stats.add(title_length, content_length)
+    for query_index, scope in enumerate(result.scopes):
+        if scope is None and active[query_index]:
+            result.item_stats[query_index].add(title_length, content_length)
+
+
+@lru_cache(maxsize=32)
+def byte_term_pattern(terms: tuple[str, ...], json_escapes: bool = False) -> re.Pattern[bytes]:
+    # Terms are merged into a prefix trie, so at each byte the engine follows one branch
+    # instead of retrying every term (cost stays flat as queries grow, like Aho-Corasick),
+    # and a lookahead on the possible first bytes lets it skip other positions quickly.
+    trie: dict[str, dict] = {}
     for term in terms:
-        count = normalized.count(term)
-        if count:
-            score += count
-            pos = normalized.find(term)
-            if first_pos == -1 or (pos != -1 and pos < first_pos):
-                first_pos = pos
-    return score, first_pos
-
-
-def build_snippet(content: str, first_pos: int, width: int = 240) -> str:
-    compact = " ".join(content.split())
-    if not compact:
-        return ""
-    if first_pos < 0:
-        return compact[:width]
-    start = max(0, first_pos - width // 3)
-    end = min(len(compact), start + width)
-    return compact[start:end]
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    first_bytes = {
+        variant.encode("utf-8")[:1] for char in trie if char for variant in case_variants(char)
+    }
+    if json_escapes and any(char and not char.isascii() for char in trie):
+        first_bytes.add(b"\\")
+    lookahead = b"(?=[" + b"".join(re.escape(byte) for byte in sorted(first_bytes)) + b"])"
+    return re.compile(lookahead + byte_trie_pattern(trie, json_escapes))
+
+
+def byte_trie_pattern(node: dict[str, dict], json_escapes: bool = False) -> bytes:
+    branches = [
+        byte_char_pattern(char, json_escapes) + byte_trie_pattern(child, json_escapes)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not branches:
+        return b""
+    body = branches[0] if len(branches) == 1 else b"(?:" + b"|".join(branches) + b")"
+    return b"(?:" + body + b")?" if "" in node else body
+
+
+def byte_char_pattern(char: str, json_escapes: bool = False) -> bytes:
+    # Case-insensitive on raw UTF-8: every char becomes a class of its case variants,
+    # which also covers Cyrillic (bytes IGNORECASE only folds ASCII).
+    variants = case_variants(char)
+    encoded = [re.escape(variant.encode("utf-8")) for variant in variants]
+    if json_escapes:
+        # json.dumps() defaults to ensure_ascii, so JSONL text may hold \uXXXX instead of UTF-8.
+        encoded.extend(
+            json_escape_pattern(variant) for variant in variants if not variant.isascii()
+        )
+    if len(encoded) == 1:
+        return encoded[0]
+    if all(len(variant.encode("utf-8")) == 1 for variant in variants):
+        return b"[" + b"".join(encoded) + b"]"
+    return b"(?:" + b"|".join(encoded) + b")"
+
+
+def json_escape_pattern(char: str) -> bytes:
+    # Astral chars are escaped as a UTF-16 surrogate pair; hex digits may be either case.
+    units = char.encode("utf-16-be")
+    pattern = b""
+    for offset in range(0, len(units), 2):
+        pattern += rb"\\u"
+        for digit in units[offset:offset + 2].hex():
+            pattern += f"[{digit}{digit.upper()}]".encode() if digit.isalpha() else digit.encode()
+    return pattern
+
+
+def case_variants(char: str) -> list[str]:
+    return sorted({char, char.lower(), char.upper()})
+
+
+def scan_file_mmap(path: Path, batch: QueryBatch, file_key: str) -> FileScan:
+    result = FileScan.empty(path, batch, file_key)
+    if result.size == 0:
+        return result
+
+    is_jsonl = path.suffix.lower() == ".jsonl"
+    pattern = byte_term_pattern(tuple(sorted(batch.terms)), json_escapes=is_jsonl)
+    try:
+        with path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if is_jsonl:
+                scan_jsonl_view(path, view, batch, pattern, result)
+                return result
+
+            if pattern.search(view) is not None:
+                for doc in iter_file_documents(path):
+                    add_scanned_document(
+                        result,
+                        doc,
+                        batch,
+                        title_length=len(doc.title.encode("utf-8")),
+                        content_length=result.size,
+                    )
+                return result
+
+            title_length = 0
+            if path.suffix.lower() == ".md":
+                heading = MARKDOWN_TITLE_BYTES_PATTERN.search(view)
+                title_length = len(heading.group(1)) if heading else 0
+            result.stats.add(title_length, result.size)
+    except (OSError, ValueError):
+        pass
+    return result
+
+
+def scan_jsonl_view(
+    path: Path,
+    view: mmap.mmap,
+    batch: QueryBatch,
+    pattern: re.Pattern[bytes],
+    result: FileScan,
+) -> None:
+    size = len(view)
+    line_index = 0
+    line_start = 0
+    while line_start < size:
+        hit = pattern.search(view, line_start)
+        hit_start = size if hit is None else view.rfind(b"\n", 0, hit.start()) + 1
+        # Lines without any byte-level hit are only counted for corpus statistics.
+        while line_start < hit_start:
+            line_end = view.find(b"\n", line_start, hit_start)
+            if line_end == -1:
+                line_end = hit_start
+            add_jsonl_line_stats(path, view[line_start:line_end], line_index, batch, result)
+            line_index += 1
+            line_start = line_end + 1
+        if hit is None:
+            break
+
+        end = view.find(b"\n", hit.end())
+        if end == -1:
+            end = size
+        line = view[hit_start:end].decode("utf-8", errors="replace").strip()
+        line_number = line_index + 1
+        line_index += 1
+        line_start = end + 1
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        content = extract_json_text(item)
+        if content:
+            doc = Document(
+                source=f"{path}::line:{line_number}",
+                content=content,
+                title=extract_json_title(item),
+            )
+            add_scanned_document(
+                result,
+                doc,
+                batch,
+                title_length=len(doc.title.encode("utf-8")),
+                content_length=end - hit_start,
+            )
+
+
+def add_jsonl_line_stats(
+    path: Path,
+    raw: bytes,
+    line_index: int,
+    batch: QueryBatch,
+    result: FileScan,
+) -> None:
+    # Counts the line exactly when add_scanned_document() would: a valid item with some tokens
+    # in its text and in scope. Only the cheap checks run; the text is not tokenized.
+    line = raw.decode("utf-8", errors="replace").strip()
+    if not line:
+        return
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError:
+        return
+    content = extract_json_text(item)
+    if not content or (ALNUM_PATTERN.search(content) is None and not tokenize(content)):
+        return
+    title = extract_json_title(item)
+    doc = Document(source=f"{path}::line:{line_index + 1}", content=content, title=title)
+    active = document_scopes(result, doc, batch)
+    if active is not None:
+        add_document_stats(result, active, len(title.encode("utf-8")), len(raw))
+
 
+def search(
+    root: Path,
+    query: Query,
+    limit: int,
+    min_score: float,
+    workers: int = 1,
+    throughput: Throughput | None = None,
+    use_mmap: bool = False,
+    timings: SearchTimings | None = None,
+) -> Iterator[Match]:
+    # Yields matches in rank order; a result's file is re-read for its snippet only when the
+    # result is due, together with any lower-ranked results from the same file.
+    requests = [(query, limit, min_score)]
+    winners = scan_winners(root, requests, workers, throughput, use_mmap, timings)[0]
+    wanted: dict[Path, set[str]] = {}
+    for _, source, path in winners:
+        wanted.setdefault(path, set()).add(source)
+    contents: dict[str, str] = {}
+    for score, source, path in winners:
+        with timed(timings, "rank"):
+            if path in wanted:
+                contents.update(load_document_contents({path: wanted.pop(path)}))
+            snippet, offsets = text_snippet(contents.pop(source, ""), query.terms)
+            match = Match(source=source, score=score, snippet=snippet, offsets=offsets)
+        yield match
 
-def search(root: Path, terms: list[str], limit: int, min_score: int) -> list[Match]:
-    results: list[Match] = []
-    for doc in iter_documents(root):
-        score, first_pos = score_document(doc.content, terms)
-        if score < min_score:
+
+def search_many(
+    root: Path,
+    requests: list[tuple[Query, int, float]],
+    workers: int = 1,
+    throughput: Throughput | None = None,
+    use_mmap: bool = False,
+) -> list[list[Match]]:
+    all_winners = scan_winners(root, requests, workers, throughput, use_mmap)
+    wanted: dict[Path, set[str]] = {}
+    for winners in all_winners:
+        for _, source, path in winners:
+            wanted.setdefault(path, set()).add(source)
+    contents = load_document_contents(wanted)
+
+    results: list[list[Match]] = []
+    for (query, _, _), winners in zip(requests, all_winners):
+        matches: list[Match] = []
+        for score, source, _ in winners:
+            snippet, offsets = text_snippet(contents.get(source, ""), query.terms)
+            matches.append(Match(source=source, score=score, snippet=snippet, offsets=offsets))
+        results.append(matches)
+    return results
+
+
+def scan_winners(
+    root: Path,
+    requests: list[tuple[Query, int, float]],
+    workers: int = 1,
+    throughput: Throughput | None = None,
+    use_mmap: bool = False,
+    timings: SearchTimings | None = None,
+) -> list[list[tuple[float, str, Path]]]:
+    # One pass over the dump for all (query, limit, min_score) requests; each keeps its own
+    # top-k of (score, source, path).
+    batch = QueryBatch(queries=[query for query, _, _ in requests])
+    doc_freqs: list[Counter] = [Counter() for _ in requests]
+    # Per request: (source, path, title_length, content_length, {term: (title_tf, content_tf)})
+    candidates: list[list[tuple[str, Path, int, int, dict[str, tuple[int, int]]]]] = [
+        [] for _ in requests
+    ]
+    # path:/ext: scopes drop files before they are read; a scoped query ranks against the
+    # statistics of its scope only, as if the dump held nothing else.
+    query_stats = [CorpusStats() for _ in requests]
+    with timed(timings, "discover"):
+        paths = [
+            path
+            for path in iter_source_files(root)
+            if any(
+                query.file_scope(path.relative_to(root).as_posix()) is not False
+                for query in batch.queries
+            )
+        ]
+    with timed(timings, "parse"):
+        for scanned in map_source_files(
+            partial(scan_file, batch=batch, root=root, use_mmap=use_mmap), paths, workers
+        ):
+            for query_index, file_candidates in enumerate(scanned.candidates):
+                scope = scanned.scopes[query_index]
+                if scope:
+                    query_stats[query_index].merge(scanned.stats)
+                elif scope is None:
+                    query_stats[query_index].merge(scanned.item_stats[query_index])
+                doc_freqs[query_index].update(scanned.doc_freq[query_index])
+                for source, title_length, content_length, freqs in file_candidates:
+                    candidates[query_index].append(
+                        (source, scanned.path, title_length, content_length, freqs)
+                    )
+            if throughput is not None:
+                throughput.add(scanned.stats.doc_count, scanned.size)
+
+    # IDF and average lengths are only final after the full pass, so ranking happens here.
+    all_winners: list[list[tuple[float, str, Path]]] = []
+    for (query, limit, min_score), stats, doc_freq, query_candidates in zip(
+        requests, query_stats, doc_freqs, candidates
+    ):
+        with timed(timings, "score"):
+            idf = {
+                term: bm25_idf(stats.doc_count, count) * query.weights.get(term, 1.0)
+                for term, count in doc_freq.items()
+            }
+            scored = [
+                (
+                    math.fsum(
+                        bm25f_term_score(
+                            idf[term], title_tf, content_tf, title_length, content_length, stats
+                        )
+                        for term, (title_tf, content_tf) in freqs.items()
+                    ),
+                    source,
+                    path,
+                )
+                for source, path, title_length, content_length, freqs in query_candidates
+            ]
+        with timed(timings, "rank"):
+            all_winners.append(
+                heapq.nsmallest(
+                    max(limit, 0),
+                    (item for item in scored if item[0] >= min_score),
+                    key=lambda item: (-item[0], item[1]),
+                )
+            )
+    return all_winners
+
+
+def load_document_contents(wanted: dict[Path, set[str]]) -> dict[str, str]:
+    contents: dict[str, str] = {}
+    for path, sources in wanted.items():
+        for doc in iter_file_documents(path):
+            if doc.source in sources:
+                contents[doc.source] = doc.content
+    return contents
+
+
+def resolve_index_dir(root: Path, arg_value: str | None) -> Path:
+    if arg_value:
+        return Path(arg_value).expanduser().resolve()
+    return root / INDEX_DIR_NAME
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_index(
+    root: Path,
+    index_dir: Path,
+    workers: int = 1,
+    throughput: Throughput | None = None,
+    dedup: bool | None = None,
+) -> IndexRefresh:
+    # dedup=None keeps the setting of the existing index (off for a new one).
+    refresh = IndexRefresh()
+    previous = open_index(index_dir, root)
+    target = index_dir / INDEX_FILE_NAME
+    tmp_path = target.with_suffix(".tmp")
+    try:
+        if dedup is None:
+            dedup = previous.dedup if previous is not None else False
+        if previous is not None and (
+            previous.tokenizer != TOKENIZER_VERSION or previous.dedup != dedup
+        ):
+            previous.close()
+            previous = None
+        refresh.full_rebuild = previous is None
+        previous_files = previous.files() if previous is not None else {}
+
+        manifest: dict[str, dict] = {}
+        kept: set[str] = set()
+        pending: list[tuple[str, Path]] = []
+        for path in iter_source_files(root):
+            key = path.relative_to(root).as_posix()
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": ""}
+            known = previous_files.get(key)
+            if known and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+                manifest[key] = known
+                kept.add(key)
+                refresh.unchanged += 1
+                continue
+
+            try:
+                entry["sha256"] = file_digest(path)
+            except OSError:
+                continue
+            manifest[key] = entry
+            if known and known["sha256"] == entry["sha256"]:
+                # Touched but identical (e.g. re-synced dump): keep postings, refresh stat.
+                kept.add(key)
+                refresh.unchanged += 1
+                continue
+
+            pending.append((key, path))
+            if known:
+                refresh.changed += 1
+            else:
+                refresh.added += 1
+        refresh.removed = len(previous_files.keys() - manifest.keys())
+        if previous is not None and dedup:
+            # Aliases have no postings of their own: when their canonical document goes away,
+            # their files are re-tokenized so they get indexed (or re-aliased) again.
+            for key in sorted(orphaned_alias_files(previous, kept)):
+                pending.append((key, root / key))
+
+        index_dir.mkdir(parents=True, exist_ok=True)
+        writer = IndexWriter(root, manifest, dedup, spill_dir=index_dir)
+        try:
+            if previous is not None:
+                writer.carry_over(previous, kept)
+            if throughput is not None:
+                # Only tokenizing and encoding new documents counts as work; carried ones are copied.
+                throughput.started = time.perf_counter()
+            add_files(writer, pending, workers, throughput)
+            if throughput is not None:
+                throughput.finished = time.perf_counter()
+            with tmp_path.open("wb") as handle:
+                writer.finish(handle)
+        finally:
+            writer.close()
+    finally:
+        if previous is not None:
+            previous.close()
+    os.replace(tmp_path, target)
+    for legacy_name in LEGACY_INDEX_FILE_NAMES:
+        (index_dir / legacy_name).unlink(missing_ok=True)
+
+    refresh.dedup = dedup
+    refresh.docs = writer.doc_count
+    refresh.terms = writer.term_count
+    refresh.aliases = sum(len(aliases) for aliases in writer.aliases.values())
+    refresh.carried = writer.carried
+    return refresh
+
+
+def orphaned_alias_files(previous: IndexReader, kept: set[str]) -> set[str]:
+    # Removes the files from `kept`; repeats because a re-tokenized file drops its own
+    # canonical documents, whose aliases elsewhere are then orphaned too.
+    alias_files = previous.alias_files()
+    orphaned: set[str] = set()
+    while True:
+        found = {
+            file_key
+            for doc_file, files in alias_files
+            if doc_file not in kept
+            for file_key in files
+            if file_key in kept
+        }
+        if not found:
+            return orphaned
+        kept -= found
+        orphaned |= found
+
+
+def build_memory_index(root: Path, workers: int = 1, throughput: Throughput | None = None) -> IndexReader:
+    writer = IndexWriter(root, {}, dedup=False)
+    pending = [(path.relative_to(root).as_posix(), path) for path in iter_source_files(root)]
+    try:
+        add_files(writer, pending, workers, throughput)
+        # The index lives in an anonymous temporary file and is read through mmap like one on
+        # disk; the mapping keeps it after the handle is closed.
+        with tempfile.TemporaryFile() as handle:
+            writer.finish(handle)
+            handle.flush()
+            view = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        writer.close()
+    return IndexReader(view, root)
+
+
+def add_files(
+    writer: IndexWriter,
+    pending: list[tuple[str, Path]],
+    workers: int,
+    throughput: Throughput | None,
+) -> None:
+    # Files go in relative path order (rglob order varies between filesystems), so the first
+    # copy of a near-duplicate that --dedup keeps is the same on every machine.
+    pending = sorted(pending)
+    keys = {path: key for key, path in pending}
+    paths = [path for _, path in pending]
+    if workers <= 1 or len(paths) < 2:
+        # One document at a time, so a large JSON(L) file is never held tokenized.
+        tokenized_files: Iterable[FileTokens] = (
+            FileTokens(path=path, size=file_size(path), docs=iter_tokenized_documents(path, writer.dedup))
+            for path in paths
+        )
+    else:
+        tokenized_files = map_source_files(
+            partial(tokenize_file, dedup=writer.dedup, max_size=TOKENIZE_INLINE_MIN_BYTES), paths, workers
+        )
+    for tokenized in tokenized_files:
+        docs = tokenized.docs
+        if docs is None:
+            docs = iter_tokenized_documents(tokenized.path, writer.dedup)
+        count = 0
+        for doc in docs:
+            writer.add_document(doc, keys[tokenized.path])
+            count += 1
+        if throughput is not None:
+            throughput.add(count, tokenized.size)
+
+
+def tokenize_file(path: Path, dedup: bool = False, max_size: int | None = None) -> FileTokens:
+    # Files of max_size bytes or more come back with docs=None, left to the caller.
+    size = file_size(path)
+    if max_size is not None and size >= max_size:
+        return FileTokens(path=path, size=size, docs=None)
+    return FileTokens(path=path, size=size, docs=list(iter_tokenized_documents(path, dedup)))
+
+
+def iter_tokenized_documents(path: Path, dedup: bool = False) -> Iterator[TokenizedDocument]:
+    for doc in iter_file_documents(path):
+        tokenized = tokenize_document(doc, dedup)
+        if tokenized is not None:
+            yield tokenized
+
+
+def tokenize_document(doc: Document, dedup: bool = False) -> TokenizedDocument | None:
+    # Collapsing whitespace does not move token positions, so the stored text is tokenized.
+    text = " ".join(doc.content.split())
+    char_checkpoints: list[tuple[int, int]] = []
+    tokens, token_positions = tokenize_positions(text, char_checkpoints)
+    if not tokens:
+        return None
+    positions: dict[str, list[int]] = {}
+    for token, position in zip(tokens, token_positions):
+        positions.setdefault(token, []).append(position)
+    checkpoints: list[tuple[int, int]] = []
+    char_offset = byte_offset = 0
+    for position, offset in char_checkpoints:
+        byte_offset += len(text[char_offset:offset].encode("utf-8"))
+        char_offset = offset
+        checkpoints.append((position, byte_offset))
+    return TokenizedDocument(
+        source=doc.source,
+        text=text,
+        title_counts=dict(Counter(tokenize(doc.title))),
+        length=len(tokens),
+        positions=positions,
+        checkpoints=checkpoints,
+        minhash=minhash(tokens) if dedup else (),
+    )
+
+
+def minhash(tokens: list[str]) -> tuple[int, ...]:
+    # One-permutation MinHash: each shingle hash lands in one of DEDUP_HASHES slots by its low
+    # bits and a slot keeps its smallest high half. Token hashes use crc32, which is stable
+    # across processes and runs (unlike hash()), so signatures stored in the index stay
+    # comparable on refresh.
+    token_hashes: dict[str, int] = {}
+    hashes: list[int] = []
+    for token in tokens:
+        value = token_hashes.get(token)
+        if value is None:
+            raw = token.encode("utf-8")
+            value = token_hashes[token] = zlib.crc32(raw) | zlib.crc32(raw, 0x9E3779B9) << 32
+        hashes.append(value)
+    mixed = [
+        (first ^ second * 0x9E3779B97F4A7C15 ^ third * 0xC2B2AE3D27D4EB4F) & UINT64_MASK
+        for first, second, third in zip(hashes, hashes[1:], hashes[2:])
+    ] or [sum(hashes) & UINT64_MASK]
+    # Sorted by (slot, high half), the first key at or after each slot start is its minimum.
+    finalized = ((value ^ value >> 31) * 0xBF58476D1CE4E5B9 & UINT64_MASK for value in mixed)
+    keys = sorted({(value % DEDUP_HASHES) << 32 | value >> 32 for value in finalized})
+    slots: list[int | None] = []
+    for slot in range(DEDUP_HASHES):
+        found = bisect.bisect_left(keys, slot << 32)
+        if found < len(keys) and keys[found] >> 32 == slot:
+            slots.append(keys[found] & UINT32_MASK)
+        else:
+            slots.append(None)
+    # Short documents leave slots empty; each borrows the next filled slot, shifted by the
+    # distance, so equal documents still get equal signatures.
+    signature: list[int] = []
+    for slot in range(DEDUP_HASHES):
+        for step in range(DEDUP_HASHES):
+            value = slots[(slot + step) % DEDUP_HASHES]
+            if value is not None:
+                signature.append((value + step * 0x9E3779B9) & UINT32_MASK)
+                break
+    return tuple(signature)
+
+
+class NearDuplicates:
+    """MinHash LSH over indexed documents for --dedup.
+
+    Signatures are bucketed by band, so a lookup only compares documents that agree on all
+    rows of at least one band with the new document.
+    """
+
+    def __init__(self) -> None:
+        self.buckets: dict[tuple[int, tuple[int, ...]], list[int]] = {}
+        self.signatures: list[tuple[int, ...]] = []
+
+    @staticmethod
+    def bands(signature: tuple[int, ...]) -> Iterator[tuple[int, tuple[int, ...]]]:
+        for band in range(DEDUP_BANDS):
+            yield band, signature[band * DEDUP_BAND_ROWS:(band + 1) * DEDUP_BAND_ROWS]
+
+    def add(self, doc_id: int, signature: tuple[int, ...]) -> None:
+        # Documents are added in doc id order.
+        self.signatures.append(signature)
+        for key in self.bands(signature):
+            self.buckets.setdefault(key, []).append(doc_id)
+
+    def find(self, signature: tuple[int, ...]) -> int | None:
+        # Most similar match, lowest doc id on ties, so the result does not depend on bucket order.
+        best: tuple[int, int] | None = None
+        required = math.ceil(DEDUP_MIN_SIMILARITY * DEDUP_HASHES)
+        for key in self.bands(signature):
+            for doc_id in self.buckets.get(key, ()):
+                same = sum(left == right for left, right in zip(self.signatures[doc_id], signature))
+                if same >= required and (best is None or (-same, doc_id) < best):
+                    best = (-same, doc_id)
+        return best[1] if best is not None else None
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint_deltas(buffer: bytes, start: int, end: int) -> list[int]:
+    values: list[int] = []
+    current = 0
+    value = 0
+    shift = 0
+    for byte in buffer[start:end]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        current += value
+        values.append(current)
+        value = 0
+        shift = 0
+    return values
+
+
+def encode_varint_string(text: str, out: bytearray) -> None:
+    raw = text.encode("utf-8")
+    encode_varint(len(raw), out)
+    out += raw
+
+
+def decode_varint(buffer: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def decode_varint_string(buffer: bytes, pos: int) -> tuple[str, int]:
+    length, pos = decode_varint(buffer, pos)
+    return bytes(buffer[pos:pos + length]).decode("utf-8"), pos + length
+
+
+def encode_varint_deltas(values: Iterable[int], out: bytearray) -> None:
+    # Length-prefixed block of ascending values, read back with decode_varint_deltas().
+    block = bytearray()
+    previous = 0
+    for value in values:
+        encode_varint(value - previous, block)
+        previous = value
+    encode_varint(len(block), out)
+    out += block
+
+
+def pack_uints(values: list[int] | array) -> tuple[str, bytes]:
+    # Narrowest array width that fits; stored little-endian regardless of host.
+    peak = max(values, default=0)
+    typecode = "B" if peak < 1 << 8 else "H" if peak < 1 << 16 else "I" if peak < 1 << 32 else "Q"
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return typecode, packed.tobytes()
+
+
+def unpack_uints(typecode: str, buffer: bytes) -> array:
+    unpacked = array(typecode)
+    unpacked.frombytes(buffer)
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked
+
+
+class PostingsBuilder:
+    """One term's postings block, built a document (or a copied block) at a time.
+
+    Layout: header (count, four array typecodes), then doc id deltas, title tfs,
+    content tfs and position-blob end offsets as fixed-width arrays, then the
+    varint-encoded position deltas of every doc back to back.
+    """
+
+    __slots__ = ("doc_deltas", "title_tfs", "content_tfs", "position_ends", "positions_blob", "last_doc")
+
+    def __init__(self) -> None:
+        self.doc_deltas = array("Q")
+        self.title_tfs = array("I")
+        self.content_tfs = array("I")
+        self.position_ends = array("Q")
+        self.positions_blob = bytearray()
+        self.last_doc = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_deltas)
+
+    def add(self, doc_id: int, title_tf: int, positions: list[int]) -> None:
+        self.doc_deltas.append(doc_id - self.last_doc)
+        self.last_doc = doc_id
+        self.title_tfs.append(title_tf)
+        self.content_tfs.append(len(positions))
+        last = 0
+        for position in positions:
+            encode_varint(position - last, self.positions_blob)
+            last = position
+        self.position_ends.append(len(self.positions_blob))
+
+    def extend(self, block: bytes, remap: array | None = None) -> None:
+        # Appends an encoded block whose doc ids follow the ones added so far. With `remap`, its
+        # doc ids are renumbered through it and docs mapped to -1 are dropped.
+        (doc_deltas, title_tfs, content_tfs, position_ends), blob = unpack_postings(block)
+        doc_ids = list(itertools.accumulate(doc_deltas))
+        title_tfs, content_tfs, position_ends = title_tfs.tolist(), content_tfs.tolist(), position_ends.tolist()
+        if remap is not None:
+            doc_ids = [remap[doc_id] for doc_id in doc_ids]
+            kept = [position for position, doc_id in enumerate(doc_ids) if doc_id >= 0]
+            if len(kept) < len(doc_ids):
+                starts = [0, *position_ends[:-1]]
+                blob = b"".join([blob[starts[position]:position_ends[position]] for position in kept])
+                position_ends = list(
+                    itertools.accumulate(position_ends[position] - starts[position] for position in kept)
+                )
+                doc_ids = [doc_ids[position] for position in kept]
+                title_tfs = [title_tfs[position] for position in kept]
+                content_tfs = [content_tfs[position] for position in kept]
+        if not doc_ids:
+            return
+        base = len(self.positions_blob)
+        self.doc_deltas.append(doc_ids[0] - self.last_doc)
+        self.doc_deltas.extend([doc_id - previous for previous, doc_id in zip(doc_ids, doc_ids[1:])])
+        self.last_doc = doc_ids[-1]
+        self.title_tfs.extend(title_tfs)
+        self.content_tfs.extend(content_tfs)
+        self.position_ends.extend([end + base for end in position_ends])
+        self.positions_blob += blob
+
+    def encode(self) -> bytes:
+        columns = [
+            pack_uints(self.doc_deltas),
+            pack_uints(self.title_tfs),
+            pack_uints(self.content_tfs),
+            pack_uints(self.position_ends),
+        ]
+        typecodes = "".join(typecode for typecode, _ in columns).encode("ascii")
+        block = bytearray(POSTINGS_HEADER.pack(len(self.doc_deltas), typecodes))
+        for _, packed in columns:
+            block += packed
+        block += self.positions_blob
+        return bytes(block)
+
+
+def unpack_postings(block: bytes, column_count: int = 4) -> tuple[list[array], bytes]:
+    # The first `column_count` fixed-width columns of a block and, when all are read, its
+    # position blob.
+    count, typecodes = POSTINGS_HEADER.unpack_from(block, 0)
+    pos = POSTINGS_HEADER.size
+    columns: list[array] = []
+    for typecode in typecodes.decode("ascii")[:column_count]:
+        width = array(typecode).itemsize * count
+        columns.append(unpack_uints(typecode, block[pos:pos + width]))
+        pos += width
+    return columns, block[pos:] if column_count == 4 else b""
+
+
+def decode_postings(block: bytes) -> PostingList:
+    (doc_deltas, title_tfs, content_tfs, position_ends), blob = unpack_postings(block)
+    return PostingList(
+        doc_ids=list(itertools.accumulate(doc_deltas)),
+        title_tfs=title_tfs,
+        content_tfs=content_tfs,
+        position_ends=position_ends,
+        positions_blob=blob,
+    )
+
+
+class IndexWriter:
+    """Writes index.bin from documents added in doc id order.
+
+    A refresh first carries over the documents of unchanged files from the previous index:
+    their records and lengths are copied, their compressed text blocks too while the text
+    stream stays mostly live, and finish() copies their postings blocks, renumbering doc ids
+    only in blocks that reach past the first dropped document. Only new documents are
+    tokenized and encoded.
+
+    Records, text blocks and the variable-size sections go to temporary files in `spill_dir`
+    (the system default when None), and postings and gram lists are spilled to sorted runs
+    there, so memory holds only the fixed-width per-document and per-term tables.
+    """
+
+    def __init__(self, root: Path, files: dict[str, dict], dedup: bool, spill_dir: Path | None = None) -> None:
+        self.root = root
+        self.files = files
+        self.dedup = dedup
+        self.spill_dir = spill_dir
+        self.spill_files: list[BinaryIO] = []
+        self.stats = CorpusStats()
+        self.doc_lengths = array("I")
+        self.file_docs: list[list] = []
+        # Doc records without their aliases, which may still grow while documents are added.
+        self.records = self.spill_file()
+        self.record_sizes = array("Q")
+        self.aliases: dict[int, list[tuple[str, str]]] = {}
+        self.duplicates = NearDuplicates() if dedup else None
+        self.text_blocks = self.spill_file()
+        self.text_block_offsets = array("Q", [0])
+        self.text_tail = bytearray()
+        self.text_size = 0
+        self.postings: dict[str, PostingsBuilder] = {}
+        self.postings_bytes = 0
+        self.postings_runs: list[BinaryIO] = []
+        self.previous: IndexReader | None = None
+        # Previous doc id -> new doc id, -1 for dropped docs; ids below first_dropped are kept.
+        self.remap = array("q")
+        self.first_dropped = 0
+        self.carried = 0
+        self.term_count = 0
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.record_sizes)
+
+    def spill_file(self) -> BinaryIO:
+        handle = tempfile.TemporaryFile(dir=self.spill_dir)
+        self.spill_files.append(handle)
+        return handle
+
+    def close(self) -> None:
+        for handle in self.spill_files:
+            handle.close()
+        self.spill_files = []
+
+    def carry_over(self, previous: IndexReader, kept: set[str]) -> None:
+        # Runs before any document is added, so carried documents keep their order and ids
+        # start at 0. The previous index must stay open until finish().
+        runs = [run for run in previous.file_docs() if run[0] in kept]
+        live_text = sum(
+            previous.doc_layout(doc_id).text_size for _, start, end in runs for doc_id in range(start, end)
+        )
+        # Copying the text stream keeps the texts of dropped docs; once they would be more
+        # than half of it, carried texts are re-compressed back to back instead.
+        compact = (
+            previous.text_block_bytes != TEXT_BLOCK_BYTES
+            or previous.text_stream_size() > 2 * live_text
+        )
+        if not compact:
+            self.copy_text_blocks(previous)
+
+        data = previous.sections["doc_data"]
+        self.remap = array("q", [-1]) * previous.doc_count
+        self.first_dropped = previous.doc_count
+        next_start = 0
+        for file_key, start, end in runs:
+            if start != next_start:
+                self.first_dropped = min(self.first_dropped, next_start)
+            next_start = end
+            for doc_id in range(start, end):
+                layout = previous.doc_layout(doc_id)
+                if compact:
+                    text_end = layout.text_offset + layout.text_size
+                    record = bytearray(data[layout.start:layout.text_field])
+                    encode_varint(self.append_text(previous.text_bytes(layout.text_offset, text_end)), record)
+                    encode_varint(layout.text_size, record)
+                    record += data[layout.minhash:layout.aliases]
+                else:
+                    record = data[layout.start:layout.aliases]
+                self.remap[doc_id] = self.doc_count
+                new_id = self.add_record(file_key, *previous.lengths(doc_id), record)
+                if self.duplicates is not None:
+                    self.duplicates.add(new_id, previous.minhash(layout))
+                    aliases = [alias for alias in previous.decode_aliases(layout.aliases) if alias[0] in kept]
+                    if aliases:
+                        self.aliases[new_id] = aliases
+        if next_start != previous.doc_count:
+            self.first_dropped = min(self.first_dropped, next_start)
+        self.previous = previous
+        self.carried = self.doc_count
+
+    def copy_text_blocks(self, previous: IndexReader) -> None:
+        # Full compressed blocks are copied as they are; the last, partial one is reopened so
+        # new texts continue it.
+        blocks = len(previous.text_block_offsets) - 1
+        if not blocks:
+            return
+        offsets = previous.text_block_offsets
+        self.text_blocks.write(previous.sections["text_blocks"][:offsets[blocks - 1]])
+        self.text_block_offsets.extend(offsets[1:blocks].tolist())
+        self.text_tail = bytearray(previous.text_block(blocks - 1))
+        self.text_size = (blocks - 1) * TEXT_BLOCK_BYTES + len(self.text_tail)
+
+    def append_text(self, text: bytes) -> int:
+        # Offset of `text` in the text stream; full blocks are compressed as they fill up.
+        offset = self.text_size
+        self.text_size += len(text)
+        self.text_tail += text
+        start = 0
+        while len(self.text_tail) - start >= TEXT_BLOCK_BYTES:
+            self.write_text_block(self.text_tail[start:start + TEXT_BLOCK_BYTES])
+            start += TEXT_BLOCK_BYTES
+        del self.text_tail[:start]
+        return offset
+
+    def write_text_block(self, raw: bytes) -> None:
+        self.text_blocks.write(zlib.compress(raw))
+        self.text_block_offsets.append(self.text_blocks.tell())
+
+    def add_record(self, file_key: str, title_length: int, length: int, record: bytes) -> int:
+        doc_id = self.doc_count
+        if self.file_docs and self.file_docs[-1][0] == file_key:
+            self.file_docs[-1][2] = doc_id + 1
+        else:
+            self.file_docs.append([file_key, doc_id, doc_id + 1])
+        self.stats.add(title_length, length)
+        self.doc_lengths.extend((title_length, length))
+        self.records.write(record)
+        self.record_sizes.append(len(record))
+        return doc_id
+
+    def add_document(self, doc: TokenizedDocument, file_key: str) -> None:
+        if self.duplicates is not None:
+            canonical = self.duplicates.find(doc.minhash)
+            if canonical is not None:
+                self.aliases.setdefault(canonical, []).append((file_key, doc.source))
+                return
+            self.duplicates.add(self.doc_count, doc.minhash)
+
+        record = bytearray()
+        # Sources are stored relative to root, so a moved or copied dump keeps its index.
+        encode_varint_string(file_key, record)
+        encode_varint_string(doc.source[len(str(self.root / file_key)):], record)
+        encode_varint_deltas((position for position, _ in doc.checkpoints), record)
+        encode_varint_deltas((offset for _, offset in doc.checkpoints), record)
+        text = doc.text.encode("utf-8")
+        encode_varint(self.append_text(text), record)
+        encode_varint(len(text), record)
+        signature = struct.pack(f"<{len(doc.minhash)}I", *doc.minhash)
+        encode_varint(len(signature), record)
+        record += signature
+        doc_id = self.add_record(file_key, sum(doc.title_counts.values()), doc.length, record)
+
+        for term, term_positions in doc.positions.items():
+            self.add_posting(term, doc_id, doc.title_counts.get(term, 0), term_positions)
+        for term in doc.title_counts.keys() - doc.positions.keys():
+            self.add_posting(term, doc_id, doc.title_counts[term], [])
+        if self.postings_bytes >= INDEX_SPILL_BYTES:
+            self.spill_postings()
+
+    def add_posting(self, term: str, doc_id: int, title_tf: int, positions: list[int]) -> None:
+        builder = self.postings.get(term)
+        if builder is None:
+            builder = self.postings[term] = PostingsBuilder()
+            self.postings_bytes += POSTINGS_BUILDER_BYTES
+        builder.add(doc_id, title_tf, positions)
+        # Fixed-width columns plus one or two varint bytes per position.
+        self.postings_bytes += 24 + 2 * len(positions)
+
+    def sorted_postings(self) -> Iterator[tuple[bytes, bytes]]:
+        # Buffered postings as (UTF-8 term, block) in term byte order; empties the buffer.
+        postings, self.postings, self.postings_bytes = self.postings, {}, 0
+        for raw_term, term in sorted((term.encode("utf-8"), term) for term in postings):
+            yield raw_term, postings.pop(term).encode()
+
+    def spill_postings(self) -> None:
+        run = self.spill_file()
+        write_run(run, self.sorted_postings())
+        self.postings_runs.append(run)
+
+    def carried_postings(self) -> Iterator[tuple[bytes, bytes]]:
+        previous = self.previous
+        if previous is None:
+            return
+        for term_id in range(previous.term_count):
+            block = previous.term_block(term_id)
+            (doc_deltas,), _ = unpack_postings(block, column_count=1)
+            if sum(doc_deltas) >= self.first_dropped:
+                builder = PostingsBuilder()
+                builder.extend(block, self.remap)
+                if not builder:
+                    continue
+                block = builder.encode()
+            yield previous.term(term_id), block
+
+    def merged_postings(self) -> Iterator[tuple[bytes, bytes]]:
+        # (UTF-8 term, block) in term byte order. Carried documents have the lowest doc ids and
+        # each spilled run continues the one before it, so a term's blocks are joined in the
+        # order heapq.merge yields them for equal keys.
+        merged = heapq.merge(
+            self.carried_postings(),
+            *(iter_run(run) for run in self.postings_runs),
+            self.sorted_postings(),
+            key=lambda item: item[0],
+        )
+        for raw_term, parts in itertools.groupby(merged, key=lambda item: item[0]):
+            blocks = [block for _, block in parts]
+            if len(blocks) > 1:
+                builder = PostingsBuilder()
+                for block in blocks:
+                    builder.extend(block)
+                blocks = [builder.encode()]
+            yield raw_term, blocks[0]
+
+    def merged_grams(self, term_grams: Iterator[tuple[int, bytes]]) -> Iterator[tuple[bytes, array]]:
+        # (UTF-8 gram, ids of the terms containing it) in gram byte order for (term id, term)
+        # pairs in term id order; runs of gram lists are spilled like postings.
+        runs: list[BinaryIO] = []
+        grams: dict[str, array] = {}
+        buffered = 0
+        for term_id, raw_term in term_grams:
+            for gram in term_trigrams(raw_term.decode("utf-8")):
+                term_ids = grams.get(gram)
+                if term_ids is None:
+                    term_ids = grams[gram] = array("Q")
+                    buffered += GRAM_LIST_BYTES
+                term_ids.append(term_id)
+                buffered += term_ids.itemsize
+            if buffered >= INDEX_SPILL_BYTES:
+                runs.append(self.spill_file())
+                write_run(runs[-1], sorted_gram_lists(grams))
+                grams, buffered = {}, 0
+        merged = heapq.merge(
+            *(iter_run(run) for run in runs), sorted_gram_lists(grams), key=lambda item: item[0]
+        )
+        for raw_gram, parts in itertools.groupby(merged, key=lambda item: item[0]):
+            term_ids = array("Q")
+            for _, packed in parts:
+                term_ids.frombytes(packed)
+            yield raw_gram, term_ids
+
+    def encode_records(self) -> tuple[BinaryIO, array]:
+        doc_data = self.spill_file()
+        doc_offsets = array("Q", [0])
+        self.records.seek(0)
+        for doc_id, size in enumerate(self.record_sizes):
+            record = bytearray(self.records.read(size))
+            aliases = self.aliases.get(doc_id, ())
+            encode_varint(len(aliases), record)
+            for file_key, source in aliases:
+                encode_varint_string(file_key, record)
+                encode_varint_string(source[len(str(self.root / file_key)):], record)
+            doc_data.write(record)
+            doc_offsets.append(doc_data.tell())
+        return doc_data, doc_offsets
+
+    def finish(self, handle: BinaryIO) -> None:
+        if self.text_tail:
+            self.write_text_block(self.text_tail)
+            self.text_tail = bytearray()
+        doc_data, doc_offsets = self.encode_records()
+
+        term_offsets = array("Q", [0])
+        term_data = self.spill_file()
+        term_entries = self.spill_file()
+        postings_data = self.spill_file()
+        for raw_term, block in self.merged_postings():
+            doc_freq, _ = POSTINGS_HEADER.unpack_from(block, 0)
+            term_entries.write(TERM_ENTRY.pack(postings_data.tell(), len(block), doc_freq))
+            postings_data.write(block)
+            term_data.write(raw_term)
+            term_offsets.append(term_data.tell())
+        self.term_count = len(term_offsets) - 1
+
+        term_data.seek(0)
+        terms = (
+            (term_id, term_data.read(term_offsets[term_id + 1] - term_offsets[term_id]))
+            for term_id in range(self.term_count)
+        )
+        gram_offsets = array("Q", [0])
+        gram_data = self.spill_file()
+        gram_term_offsets = array("Q", [0])
+        gram_terms = self.spill_file()
+        for raw_gram, term_ids in self.merged_grams(terms):
+            gram_data.write(raw_gram)
+            gram_offsets.append(gram_data.tell())
+            deltas = bytearray()
+            previous = 0
+            for term_id in term_ids:
+                encode_varint(term_id - previous, deltas)
+                previous = term_id
+            gram_terms.write(deltas)
+            gram_term_offsets.append(gram_terms.tell())
+
+        meta = {
+            "version": INDEX_FORMAT_VERSION,
+            "tokenizer": TOKENIZER_VERSION,
+            "dedup": self.dedup,
+            "doc_count": self.stats.doc_count,
+            "term_count": self.term_count,
+            "gram_count": len(gram_offsets) - 1,
+            "text_block_bytes": TEXT_BLOCK_BYTES,
+            "title_length_total": self.stats.title_length_total,
+            "content_length_total": self.stats.content_length_total,
+        }
+        columns = (
+            self.doc_lengths,
+            doc_offsets,
+            term_offsets,
+            gram_offsets,
+            gram_term_offsets,
+            self.text_block_offsets,
+        )
+        for column in columns:
+            if sys.byteorder == "big":
+                column.byteswap()
+        write_sections(
+            handle,
+            {
+                "meta": json.dumps(meta).encode("utf-8"),
+                "files": json.dumps(self.files, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                "file_docs": json.dumps(self.file_docs, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                "doc_lengths": self.doc_lengths.tobytes(),
+                "doc_offsets": doc_offsets.tobytes(),
+                "doc_data": doc_data,
+                "term_offsets": term_offsets.tobytes(),
+                "term_data": term_data,
+                "term_entries": term_entries,
+                "postings": postings_data,
+                "gram_offsets": gram_offsets.tobytes(),
+                "gram_data": gram_data,
+                "gram_term_offsets": gram_term_offsets.tobytes(),
+                "gram_terms": gram_terms,
+                "text_block_offsets": self.text_block_offsets.tobytes(),
+                "text_blocks": self.text_blocks,
+            },
+        )
+
+
+def sorted_gram_lists(grams: dict[str, array]) -> Iterator[tuple[bytes, bytes]]:
+    for raw_gram, gram in sorted((gram.encode("utf-8"), gram) for gram in grams):
+        yield raw_gram, grams[gram].tobytes()
+
+
+def write_run(handle: BinaryIO, records: Iterable[tuple[bytes, bytes]]) -> None:
+    for key, value in records:
+        handle.write(RUN_RECORD.pack(len(key), len(value)))
+        handle.write(key)
+        handle.write(value)
+    handle.flush()
+
+
+def iter_run(handle: BinaryIO) -> Iterator[tuple[bytes, bytes]]:
+    # Records of a run written by write_run(), read back from its start.
+    handle.seek(0)
+    while header := handle.read(RUN_RECORD.size):
+        key_size, value_size = RUN_RECORD.unpack(header)
+        yield handle.read(key_size), handle.read(value_size)
+
+
+def write_sections(handle: BinaryIO, sections: dict[str, bytes | BinaryIO]) -> None:
+    # Sections are 8-byte aligned after the header and section table; file-like sections are
+    # copied from their start.
+    sizes = {
+        name: len(payload) if isinstance(payload, bytes) else payload.seek(0, os.SEEK_END)
+        for name, payload in sections.items()
+    }
+    offset = INDEX_HEADER.size + INDEX_SECTION_ENTRY.size * len(INDEX_SECTIONS)
+    table = bytearray(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, len(INDEX_SECTIONS)))
+    paddings: list[int] = []
+    for name in INDEX_SECTIONS:
+        paddings.append(-offset % 8)
+        offset += paddings[-1]
+        table += INDEX_SECTION_ENTRY.pack(offset, sizes[name])
+        offset += sizes[name]
+    handle.write(table)
+    for name, padding in zip(INDEX_SECTIONS, paddings):
+        handle.write(b"\x00" * padding)
+        payload = sections[name]
+        if isinstance(payload, bytes):
+            handle.write(payload)
+        else:
+            payload.seek(0)
+            shutil.copyfileobj(payload, handle)
+
+
+class IndexReader:
+    """Lazy, mmap-backed view of index.bin.
+
+    Opening reads only the header, meta and fixed-width doc/term tables; a term lookup is a
+    binary search over the sorted dictionary followed by one read of its postings block.
+    """
+
+    def __init__(self, view: mmap.mmap | bytes, root: Path) -> None:
+        self.root = root
+        self.view = view
+        try:
+            magic, version, section_count = INDEX_HEADER.unpack_from(self.view, 0)
+            if magic != INDEX_MAGIC or version != INDEX_FORMAT_VERSION:
+                raise ValueError("Unsupported index format.")
+            self.sections: dict[str, memoryview] = {}
+            buffer = memoryview(self.view)
+            for position, name in enumerate(INDEX_SECTIONS[:section_count]):
+                offset, length = INDEX_SECTION_ENTRY.unpack_from(
+                    self.view, INDEX_HEADER.size + position * INDEX_SECTION_ENTRY.size
+                )
+                self.sections[name] = buffer[offset:offset + length]
+            self.meta = json.loads(bytes(self.sections["meta"]))
+            self.doc_lengths = self.uint_column("doc_lengths", "I")
+            self.doc_offsets = self.uint_column("doc_offsets", "Q")
+            self.term_offsets = self.uint_column("term_offsets", "Q")
+            self.gram_offsets = self.uint_column("gram_offsets", "Q")
+            self.gram_term_offsets = self.uint_column("gram_term_offsets", "Q")
+            self.text_block_offsets = self.uint_column("text_block_offsets", "Q")
+            self.text_block_bytes: int = self.meta["text_block_bytes"]
+            self.text_block_cache: dict[int, bytes] = {}
+        except (KeyError, ValueError, struct.error):
+            self.close()
+            raise ValueError("Corrupt or unsupported index file.")
+
+    def uint_column(self, name: str, fmt: str) -> memoryview | array:
+        section = self.sections[name]
+        if sys.byteorder == "little":
+            return section.cast(fmt)
+        return unpack_uints(fmt, bytes(section))
+
+    def close(self) -> None:
+        self.sections = {}
+        self.doc_lengths = self.doc_offsets = self.term_offsets = memoryview(b"")
+        self.gram_offsets = self.gram_term_offsets = self.text_block_offsets = memoryview(b"")
+        self.text_block_cache = {}
+        if isinstance(self.view, mmap.mmap):
+            try:
+                self.view.close()
+            except BufferError:
+                pass
+
+    @property
+    def tokenizer(self) -> int:
+        return self.meta.get("tokenizer", 0)
+
+    @property
+    def dedup(self) -> bool:
+        return self.meta.get("dedup", False)
+
+    @property
+    def doc_count(self) -> int:
+        return self.meta["doc_count"]
+
+    @property
+    def term_count(self) -> int:
+        return self.meta["term_count"]
+
+    def corpus_stats(self) -> CorpusStats:
+        return CorpusStats(
+            doc_count=self.meta["doc_count"],
+            title_length_total=self.meta["title_length_total"],
+            content_length_total=self.meta["content_length_total"],
+        )
+
+    def files(self) -> dict[str, dict]:
+        return json.loads(bytes(self.sections["files"]))
+
+    def file_docs(self) -> list[tuple[str, int, int]]:
+        return [tuple(run) for run in json.loads(bytes(self.sections["file_docs"]))]
+
+    def scope_stats(self, scope: DocScope) -> CorpusStats:
+        stats = CorpusStats(doc_count=scope.doc_count)
+        for start, end in zip(scope.starts, scope.ends):
+            stats.title_length_total += sum(self.doc_lengths[2 * start:2 * end:2])
+            stats.content_length_total += sum(self.doc_lengths[2 * start + 1:2 * end:2])
+        return stats
+
+    def item_key(self, doc_id: int) -> str:
+        data = self.sections["doc_data"]
+        _, pos = decode_varint_string(data, self.doc_offsets[doc_id])
+        suffix, _ = decode_varint_string(data, pos)
+        return suffix[2:]
+
+    def lengths(self, doc_id: int) -> tuple[int, int]:
+        return self.doc_lengths[2 * doc_id], self.doc_lengths[2 * doc_id + 1]
+
+    def source(self, doc_id: int) -> str:
+        data = self.sections["doc_data"]
+        file_key, pos = decode_varint_string(data, self.doc_offsets[doc_id])
+        suffix, _ = decode_varint_string(data, pos)
+        return str(self.root / file_key) + suffix
+
+    def doc_layout(self, doc_id: int) -> DocLayout:
+        data = self.sections["doc_data"]
+        start = pos = self.doc_offsets[doc_id]
+        # Skip file key, source suffix and both checkpoint blocks.
+        for _ in range(4):
+            size, pos = decode_varint(data, pos)
+            pos += size
+        text_field = pos
+        text_offset, pos = decode_varint(data, pos)
+        text_size, minhash_field = decode_varint(data, pos)
+        size, pos = decode_varint(data, minhash_field)
+        return DocLayout(start, text_field, text_offset, text_size, minhash_field, pos + size)
+
+    def minhash(self, layout: DocLayout) -> tuple[int, ...]:
+        size, pos = decode_varint(self.sections["doc_data"], layout.minhash)
+        return struct.unpack_from(f"<{size // 4}I", self.sections["doc_data"], pos)
+
+    def aliases(self, doc_id: int) -> list[str]:
+        if not self.dedup:
+            return []
+        return [source for _, source in self.decode_aliases(self.doc_layout(doc_id).aliases)]
+
+    def alias_files(self) -> list[tuple[str, set[str]]]:
+        # (file key of each doc with aliases, file keys of its aliases)
+        if not self.dedup:
+            return []
+        alias_files: list[tuple[str, set[str]]] = []
+        for file_key, start, end in self.file_docs():
+            for doc_id in range(start, end):
+                aliases = self.decode_aliases(self.doc_layout(doc_id).aliases)
+                if aliases:
+                    alias_files.append((file_key, {alias_key for alias_key, _ in aliases}))
+        return alias_files
+
+    def decode_aliases(self, pos: int) -> list[tuple[str, str]]:
+        data = self.sections["doc_data"]
+        count, pos = decode_varint(data, pos)
+        aliases: list[tuple[str, str]] = []
+        for _ in range(count):
+            file_key, pos = decode_varint_string(data, pos)
+            suffix, pos = decode_varint_string(data, pos)
+            aliases.append((file_key, str(self.root / file_key) + suffix))
+        return aliases
+
+    def checkpoints(self, pos: int) -> tuple[list[int], list[int], int]:
+        data = self.sections["doc_data"]
+        size, pos = decode_varint(data, pos)
+        positions = decode_varint_deltas(data, pos, pos + size)
+        size, pos = decode_varint(data, pos + size)
+        offsets = decode_varint_deltas(data, pos, pos + size)
+        return positions, offsets, pos + size
+
+    def text_bytes(self, start: int, end: int) -> bytes:
+        # Inflates the text blocks overlapping [start, end) of the concatenated document texts.
+        first, last = start // self.text_block_bytes, (end - 1) // self.text_block_bytes
+        chunks = [self.text_block(block) for block in range(first, last + 1)]
+        skip = first * self.text_block_bytes
+        return b"".join(chunks)[start - skip:end - skip]
+
+    def text_stream_size(self) -> int:
+        # Uncompressed size of the text stream, including texts no document points at anymore.
+        blocks = len(self.text_block_offsets) - 1
+        if not blocks:
+            return 0
+        return (blocks - 1) * self.text_block_bytes + len(self.text_block(blocks - 1))
+
+    def text_block(self, block: int) -> bytes:
+        cached = self.text_block_cache.get(block)
+        if cached is None:
+            if len(self.text_block_cache) >= TEXT_BLOCK_CACHE_SIZE:
+                self.text_block_cache.clear()
+            compressed = self.sections["text_blocks"][
+                self.text_block_offsets[block]:self.text_block_offsets[block + 1]
+            ]
+            cached = self.text_block_cache[block] = zlib.decompress(compressed)
+        return cached
+
+    def snippet(
+        self, doc_id: int, hits: list[tuple[int, str]], terms: list[str]
+    ) -> tuple[str, list[tuple[int, str]]]:
+        # Decodes only a window of the stored text that starts at the checkpoint before the
+        # passage; the window doubles while it may end before the snippet does.
+        data = self.sections["doc_data"]
+        _, pos = decode_varint_string(data, self.doc_offsets[doc_id])
+        _, pos = decode_varint_string(data, pos)
+        positions, offsets, pos = self.checkpoints(pos)
+        text_start, pos = decode_varint(data, pos)
+        text_size, _ = decode_varint(data, pos)
+        start = passage_start(hits)
+        base_position = base_offset = 0
+        if start:
+            checkpoint = bisect.bisect_right(positions, start) - 1
+            base_position, base_offset = positions[checkpoint], offsets[checkpoint]
+        read_size = SNIPPET_READ_BYTES
+        while True:
+            end = min(base_offset + read_size, text_size)
+            window = self.text_bytes(text_start + base_offset, text_start + end).decode(
+                "utf-8", errors="ignore"
+            )
+            position = offset = 0
+            last_word = False
+            if start:
+                starts: list[tuple[int, int]] = []
+                tokenize_positions(window, starts, spacing=0)
+                found = word_at(starts, start - base_position)
+                if found >= 0:
+                    position, offset = starts[found]
+                last_word = found == len(starts) - 1
+            if end == text_size or (not last_word and len(window) - offset > SNIPPET_WIDTH):
+                shown = compact_window(window, offset)
+                snippet_position = base_position + position
+                return highlight_terms(shown, terms), snippet_hits(hits, snippet_position, shown)
+            read_size *= 2
+
+    def term(self, term_id: int) -> bytes:
+        return bytes(self.sections["term_data"][self.term_offsets[term_id]:self.term_offsets[term_id + 1]])
+
+    def find_term(self, term: str) -> int:
+        return self.find_key(term, self.term, self.term_count)
+
+    def term_doc_freq(self, term_id: int) -> int:
+        return TERM_ENTRY.unpack_from(self.sections["term_entries"], term_id * TERM_ENTRY.size)[2]
+
+    def gram(self, gram_id: int) -> bytes:
+        return bytes(self.sections["gram_data"][self.gram_offsets[gram_id]:self.gram_offsets[gram_id + 1]])
+
+    def gram_term_ids(self, gram: str) -> list[int]:
+        gram_id = self.find_key(gram, self.gram, self.meta["gram_count"])
+        if gram_id == -1:
+            return []
+        return decode_varint_deltas(
+            self.sections["gram_terms"],
+            self.gram_term_offsets[gram_id],
+            self.gram_term_offsets[gram_id + 1],
+        )
+
+    @staticmethod
+    def find_key(key: str, key_at: Callable[[int], bytes], count: int) -> int:
+        # Binary search over a dictionary section sorted by UTF-8 bytes.
+        target = key.encode("utf-8")
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if key_at(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count and key_at(low) == target:
+            return low
+        return -1
+
+    def term_block(self, term_id: int) -> bytes:
+        offset, length, _ = TERM_ENTRY.unpack_from(self.sections["term_entries"], term_id * TERM_ENTRY.size)
+        return bytes(self.sections["postings"][offset:offset + length])
+
+    def term_postings(self, term_id: int) -> PostingList:
+        return decode_postings(self.term_block(term_id))
+
+    def postings(self, term: str) -> PostingList | None:
+        term_id = self.find_term(term)
+        return self.term_postings(term_id) if term_id != -1 else None
+
+def open_index(index_dir: Path, root: Path) -> IndexReader | None:
+    try:
+        with (index_dir / INDEX_FILE_NAME).open("rb") as handle:
+            view = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        return IndexReader(view, root)
+    except ValueError:
+        view.close()
+        return None
+
+
+def search_index(reader: IndexReader, query: Query, limit: int, min_score: float) -> list[Match]:
+    return list(iter_search_index(reader, query, limit, min_score))
+
+
+def iter_search_index(
+    reader: IndexReader,
+    query: Query,
+    limit: int,
+    min_score: float,
+    timings: SearchTimings | None = None,
+) -> Iterator[Match]:
+    # Ranks are final once MaxScore returns; snippets are then decoded one result at a time.
+    with timed(timings, "parse"):
+        if query.fuzzy:
+            query = expand_fuzzy(reader, query)
+        scope = resolve_scope(reader, query) if query.scoped else None
+        stats = reader.scope_stats(scope) if scope is not None else reader.corpus_stats()
+        postings = {
+            term: term_postings
+            for term in query.terms
+            if (term_postings := reader.postings(term)) is not None
+        }
+    with timed(timings, "score"):
+        ranked = maxscore_top_k(reader, query, postings, stats, limit, min_score, scope)
+
+    for score, doc_id in ranked:
+        with timed(timings, "rank"):
+            # Query term positions of the winner come straight from its postings.
+            hits: list[tuple[int, str]] = []
+            for term, term_postings in postings.items():
+                found = bisect.bisect_left(term_postings.doc_ids, doc_id)
+                if found < len(term_postings.doc_ids) and term_postings.doc_ids[found] == doc_id:
+                    hits.extend((position, term) for position in term_postings.positions(found))
+            snippet, offsets = reader.snippet(doc_id, hits, query.terms)
+            match = Match(
+                source=reader.source(doc_id),
+                score=score,
+                snippet=snippet,
+                aliases=reader.aliases(doc_id),
+                offsets=offsets,
+            )
+        yield match
+
+
+def resolve_scope(reader: IndexReader, query: Query) -> DocScope:
+    # Whole files are kept or dropped by key; only .json dumps keyed by document path
+    # need their per-document item keys decoded.
+    scope = DocScope()
+    for file_key, start, end in reader.file_docs():
+        file_scope = query.file_scope(file_key)
+        if file_scope:
+            scope.add(start, end)
+        elif file_scope is None:
+            for doc_id in range(start, end):
+                if query.item_in_scope(reader.item_key(doc_id)):
+                    scope.add(doc_id, doc_id + 1)
+    return scope
+
+
+def expand_fuzzy(reader: IndexReader, query: Query) -> Query:
+    # Phrase/NEAR constraints stay exact; expansions only add optional, down-weighted terms.
+    weights = dict(query.weights)
+    for term in query.terms:
+        if len(term) < FUZZY_MIN_TERM_LENGTH:
+            continue
+        for candidate, distance in fuzzy_terms(reader, term, query.fuzzy):
+            if candidate not in query.terms:
+                weights[candidate] = max(weights.get(candidate, 0.0), 1.0 / (1 + distance))
+    return replace(query, terms=sorted(set(query.terms) | weights.keys()), weights=weights)
+
+
+def fuzzy_terms(reader: IndexReader, term: str, max_distance: int) -> list[tuple[str, int]]:
+    # Trigram filter, then exact verification. An edit (including an adjacent swap) breaks at
+    # most 4 trigrams of "^term$", so closer terms share enough of them; candidates must share
+    # at least one, which can miss distance-2 matches of very short terms.
+    grams = term_trigrams(term)
+    shared: Counter = Counter()
+    for gram in grams:
+        shared.update(reader.gram_term_ids(gram))
+    threshold = max(len(grams) - 4 * max_distance, 1)
+    found: list[tuple[int, int, str]] = []
+    for term_id, count in shared.items():
+        if count < threshold:
+            continue
+        candidate = reader.term(term_id).decode("utf-8")
+        if abs(len(candidate) - len(term)) > max_distance:
+            continue
+        distance = edit_distance(term, candidate, max_distance)
+        if distance is not None:
+            found.append((distance, -reader.term_doc_freq(term_id), candidate))
+    found.sort()
+    return [(candidate, distance) for distance, _, candidate in found[:FUZZY_MAX_EXPANSIONS]]
+
+
+def term_trigrams(term: str) -> set[str]:
+    padded = f"^{term}$"
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+
+def edit_distance(left: str, right: str, limit: int) -> int | None:
+    # Optimal string alignment distance (Levenshtein plus adjacent swaps), or None above limit.
+    # Only the diagonal band |i - j| <= limit can stay within the limit.
+    if abs(len(left) - len(right)) > limit:
+        return None
+    over = limit + 1
+    previous2: list[int] = []
+    previous = [j if j <= limit else over for j in range(len(right) + 1)]
+    for i in range(1, len(left) + 1):
+        current = [over] * (len(right) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(max(1, i - limit), min(len(right), i + limit) + 1):
+            cost = 0 if left[i - 1] == right[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and left[i - 1] == right[j - 2] and left[i - 2] == right[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = min(value, over)
+        if min(current) > limit:
+            return None
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def maxscore_top_k(
+    reader: IndexReader,
+    query: Query,
+    postings: dict[str, PostingList],
+    stats: CorpusStats,
+    limit: int,
+    min_score: float,
+    scope: DocScope | None = None,
+) -> list[tuple[float, int]]:
+    if limit < 1 or (scope is not None and not scope.starts):
+        return []
+
+    cursors = [
+        TermCursor(
+            term=term,
+            postings=term_postings,
+            idf=bm25_idf(
+                stats.doc_count,
+                scope.count(term_postings.doc_ids) if scope is not None else len(term_postings.doc_ids),
+            )
+            * query.weights.get(term, 1.0),
+        )
+        for term, term_postings in postings.items()
+    ]
+    # Phrase/NEAR/title: terms get their own cursors, only advanced to verify candidates.
+    constraint_cursors = {cursor.term: TermCursor(cursor.term, cursor.postings, cursor.idf) for cursor in cursors}
+    if any(term not in constraint_cursors for term in query.required_terms | set(query.title_terms)):
+        return []
+
+    def constraint_positions(term: str) -> list[int]:
+        cursor = constraint_cursors[term]
+        return cursor.postings.positions(cursor.position)
+
+    def satisfies_constraints(doc_id: int) -> bool:
+        for term in query.required_terms:
+            cursor = constraint_cursors[term]
+            cursor.seek(doc_id)
+            if cursor.doc_id != doc_id:
+                return False
+        for term in query.title_terms:
+            cursor = constraint_cursors[term]
+            cursor.seek(doc_id)
+            if cursor.doc_id != doc_id or not cursor.postings.title_tfs[cursor.position]:
+                return False
+        return query.matches(constraint_positions)
+
+    # BM25 saturation keeps every term contribution below its idf, which makes idf a
+    # safe per-term upper bound. Cursors are ordered by bound so that the cheapest
+    # lists form the "non-essential" prefix that is only probed for candidates.
+    cursors.sort(key=lambda cursor: cursor.idf)
+    bound_prefix: list[float] = []
+    running = 0.0
+    for cursor in cursors:
+        running += cursor.idf
+        bound_prefix.append(running)
+
+    def term_score(cursor: TermCursor) -> float:
+        title_length, content_length = reader.lengths(cursor.doc_id)
+        return bm25f_term_score(
+            cursor.idf,
+            cursor.postings.title_tfs[cursor.position],
+            cursor.postings.content_tfs[cursor.position],
+            title_length,
+            content_length,
+            stats,
+        )
+
+    heap: list[tuple[float, DescendingText, int]] = []
+    threshold = min_score
+    first_essential = 0
+    while first_essential < len(cursors) and bound_prefix[first_essential] < threshold:
+        first_essential += 1
+
+    while first_essential < len(cursors):
+        essential = cursors[first_essential:]
+        doc_id = min(cursor.doc_id for cursor in essential)
+        if doc_id == EXHAUSTED_DOC_ID:
+            break
+        if scope is not None:
+            # Out-of-scope runs are skipped by seeking, never scored.
+            target = scope.next_doc(doc_id)
+            if target != doc_id:
+                for cursor in essential:
+                    cursor.seek(target)
+                continue
+
+        contributions: list[float] = []
+        for cursor in essential:
+            if cursor.doc_id == doc_id:
+                contributions.append(term_score(cursor))
+                cursor.position += 1
+        partial = sum(contributions)
+
+        pruned = False
+        for probe in range(first_essential - 1, -1, -1):
+            if partial + bound_prefix[probe] < threshold:
+                pruned = True
+                break
+            cursor = cursors[probe]
+            cursor.seek(doc_id)
+            if cursor.doc_id == doc_id:
+                contribution = term_score(cursor)
+                contributions.append(contribution)
+                partial += contribution
+        if pruned:
+            continue
+
+        score = math.fsum(contributions)
+        if score < min_score or (len(heap) == limit and score < heap[0][0]):
+            continue
+        if not satisfies_constraints(doc_id):
+            continue
+        entry = (score, DescendingText(reader.source(doc_id)), doc_id)
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
             continue
-        snippet = build_snippet(doc.content, first_pos)
-        results.append(Match(source=doc.source, score=score, snippet=snippet))
 
-    results.sort(key=lambda item: (-item.score, item.source))
-    return results[:limit]
+        if len(heap) == limit and heap[0][0] > threshold:
+            threshold = heap[0][0]
+            while first_essential < len(cursors) and bound_prefix[first_essential] < threshold:
+                first_essential += 1
 
+    return [(score, doc_id) for score, _, doc_id in sorted(heap, reverse=True)]
 
-def print_results(matches: Iterable[Match]) -> None:
-    for index, match in enumerate(matches, start=1):
-        print(f"{index}. [{match.score}] {match.source}")
-        print(f"   {match.snippet}")
+
+def write_results(matches: Iterable[Match], output_format: str = "text") -> list[Match]:
+    # Each result is flushed as soon as it is produced, so consumers can start on the top hits.
+    written: list[Match] = []
+    for rank, match in enumerate(matches, start=1):
+        if output_format == "jsonl":
+            line = json.dumps({"rank": rank, **match_to_dict(match)}, ensure_ascii=False)
+        else:
+            line = format_match(rank, match)
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+        written.append(match)
+    return written
+
+
+def format_match(rank: int, match: Match) -> str:
+    lines = [f"{rank}. [{match.score:.3f}] {match.source}", f"   {match.snippet}"]
+    if match.aliases:
+        more = f" (+{len(match.aliases) - 3} more)" if len(match.aliases) > 3 else ""
+        lines.append(f"   also: {', '.join(match.aliases[:3])}{more}")
+    return "\n".join(lines)
+
+
+def match_to_dict(match: Match) -> dict:
+    item = {
+        "source": match.source,
+        "score": round(match.score, 6),
+        "snippet": match.snippet,
+        "offsets": [list(hit) for hit in match.offsets],
+    }
+    if match.aliases:
+        item["aliases"] = match.aliases
+    return item
+
+
+def write_stats(timings: SearchTimings | None, mode: str, results: int, output_format: str) -> None:
+    if timings is None:
+        return
+    if output_format == "jsonl":
+        sys.stdout.write(json.dumps({"stats": timings.to_dict(mode, results)}) + "\n")
+    else:
+        print(timings.summary(mode, results), file=sys.stderr)
+
+
+def parse_search_request(
+    request: object, limit: int, min_score: float, fuzzy: int = 0
+) -> tuple[dict, tuple[Query, int, float] | None]:
+    # JSON request line shared by --serve and --queries-file; limit/min_score/fuzzy are defaults.
+    if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+        return {"error": 'Request must be a JSON object with a "query" string.'}, None
+    response: dict = {"id": request["id"]} if "id" in request else {}
+    try:
+        limit = int(request.get("limit", limit))
+        min_score = float(request.get("min_score", min_score))
+        fuzzy = int(request.get("fuzzy", fuzzy))
+    except (TypeError, ValueError):
+        response["error"] = "limit, min_score and fuzzy must be numbers."
+        return response, None
+    if not 0 <= fuzzy <= FUZZY_MAX_DISTANCE:
+        response["error"] = f"fuzzy must be between 0 and {FUZZY_MAX_DISTANCE}."
+        return response, None
+    query = parse_query(request["query"], fuzzy)
+    if not query.terms:
+        response["error"] = "Query must contain at least one searchable term."
+        return response, None
+    return response, (query, limit, min_score)
+
+
+def run_queries_file(
+    lines: list[str],
+    root: Path,
+    index_dir: Path,
+    args: argparse.Namespace,
+    workers: int,
+) -> None:
+    responses: list[dict] = []
+    requests: list[tuple[Query, int, float]] = []
+    pending: list[dict] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as exc:
+            responses.append({"error": f"Invalid JSON: {exc}"})
+            continue
+        response, parsed = parse_search_request(
+            request, args.limit, args.min_score, args.fuzzy or 0
+        )
+        responses.append(response)
+        if parsed is not None:
+            requests.append(parsed)
+            pending.append(response)
+
+    reader = None if args.scan else open_index(index_dir, root)
+    if reader is None and any(query.fuzzy for query, _, _ in requests):
+        reader = build_memory_index(root, workers)
+    if reader is not None:
+        try:
+            results = [
+                search_index(reader, query=query, limit=limit, min_score=min_score)
+                for query, limit, min_score in requests
+            ]
+        finally:
+            reader.close()
+    else:
+        throughput = Throughput()
+        results = search_many(root, requests, workers, throughput, use_mmap=args.mmap)
+        print(throughput.summary(), file=sys.stderr)
+    for response, matches in zip(pending, results):
+        response["results"] = [match_to_dict(match) for match in matches]
+    for response in responses:
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+
+
+def index_signature(index_dir: Path) -> tuple[int, int, int] | None:
+    try:
+        stat = (index_dir / INDEX_FILE_NAME).stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def dump_fingerprint(root: Path) -> str:
+    digest = hashlib.sha256()
+    entries = []
+    for path in iter_source_files(root):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((path.relative_to(root).as_posix(), stat.st_size, stat.st_mtime_ns))
+    for entry in sorted(entries):
+        digest.update("\0".join(map(str, entry)).encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+
+class QueryCache:
+    """On-disk LRU of ranked matches, partitioned by search mode and corpus fingerprint.
+
+    Storing a result for a new fingerprint drops the other partitions of that mode, so entries
+    never outlive the index or dump they were computed from. File mtimes track recency.
+    """
+
+    def __init__(self, directory: Path, mode: str, fingerprint: str, max_entries: int) -> None:
+        self.directory = directory
+        self.mode = mode
+        digest = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+        self.partition = directory / f"{mode}-{digest}"
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(query: Query, limit: int, min_score: float) -> str:
+        # Results depend only on the parsed query, limit and min score, so equivalent spellings
+        # share one entry. Matches are stored unformatted, so text and jsonl output share it too.
+        return json.dumps(
+            [
+                INDEX_FORMAT_VERSION,
+                TOKENIZER_VERSION,
+                QUERY_CACHE_VERSION,
+                query.terms,
+                query.phrases,
+                query.near,
+                query.fuzzy,
+                query.title_terms,
+                query.paths,
+                query.extensions,
+                limit,
+                min_score,
+            ],
+            ensure_ascii=False,
+        )
+
+    def entry_path(self, key: str) -> Path:
+        return self.partition / (hashlib.sha256(key.encode("utf-8")).hexdigest() + ".entry")
+
+    def get(self, key: str) -> list[Match] | None:
+        path = self.entry_path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("key") != key:
+            return None
+        return [Match(**item) for item in entry["results"]]
+
+    def put(self, key: str, matches: list[Match]) -> None:
+        # Best effort: a read-only dump or a concurrent writer just means no caching.
+        try:
+            self.partition.mkdir(parents=True, exist_ok=True)
+            for stale in self.directory.glob(f"{self.mode}-*"):
+                if stale != self.partition:
+                    shutil.rmtree(stale, ignore_errors=True)
+            path = self.entry_path(key)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            entry = {"key": key, "results": [match_to_dict(match) for match in matches]}
+            tmp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.partition.glob("*.entry"):
+            try:
+                entries.append((path.stat().st_mtime_ns, path))
+            except OSError:
+                continue
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[: len(entries) - self.max_entries]:
+            path.unlink(missing_ok=True)
+
+
+class QueryService:
+    """Keeps one index open across queries; reopens it when index.bin is rewritten."""
+
+    def __init__(
+        self,
+        root: Path,
+        index_dir: Path,
+        workers: int,
+        use_disk_index: bool,
+        defaults: tuple[int, float, int] = (10, 0.0, 0),
+    ) -> None:
+        self.root = root
+        self.index_dir = index_dir
+        self.workers = workers
+        self.use_disk_index = use_disk_index
+        # limit, min_score and fuzzy for requests that leave them out: the --serve arguments.
+        self.defaults = defaults
+        self.signature: tuple[int, int, int] | None = None
+        self.reader: IndexReader | None = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        signature = index_signature(self.index_dir) if self.use_disk_index else None
+        if self.reader is not None and signature == self.signature:
+            return
+
+        reader = open_index(self.index_dir, self.root) if signature is not None else None
+        if reader is None and self.reader is not None:
+            return
+        if reader is None:
+            throughput = Throughput()
+            reader = build_memory_index(self.root, self.workers, throughput)
+            print(f"No index on disk, built in memory. {throughput.summary()}", file=sys.stderr)
+        if self.reader is not None:
+            self.reader.close()
+        self.reader, self.signature = reader, signature
+
+    def handle(self, request: object) -> dict:
+        response, parsed = parse_search_request(request, *self.defaults)
+        if parsed is None:
+            return response
+        query, limit, min_score = parsed
+
+        started = time.perf_counter()
+        self.refresh()
+        matches = search_index(self.reader, query=query, limit=limit, min_score=min_score)
+        response["results"] = [match_to_dict(match) for match in matches]
+        response["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return response
+
+    def handle_line(self, line: str) -> str:
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as exc:
+            response = {"error": f"Invalid JSON: {exc}"}
+        else:
+            response = self.handle(request)
+        return json.dumps(response, ensure_ascii=False)
+
+    def close(self) -> None:
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+def serve_stdio(service: QueryService) -> None:
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        sys.stdout.write(service.handle_line(line) + "\n")
+        sys.stdout.flush()
+
+
+def serve_socket(service: QueryService, socket_path: Path) -> None:
+    if not hasattr(socket, "AF_UNIX"):
+        raise SystemExit("Unix sockets are not supported on this platform; use stdin/stdout --serve.")
+    check_socket_path(socket_path)
+    if socket_path.is_socket():
+        socket_path.unlink()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            for raw in self.rfile:
+                line = raw.decode("utf-8", errors="replace")
+                if not line.strip():
+                    continue
+                self.wfile.write((service.handle_line(line) + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+    try:
+        server = socketserver.UnixStreamServer(str(socket_path), Handler)
+    except OSError as exc:
+        raise SystemExit(f"Cannot listen on --socket {socket_path}: {exc}")
+    with server:
+        print(f"Serving {service.reader.doc_count} documents on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def check_socket_path(socket_path: Path) -> None:
+    # A stale socket from an earlier server is replaced; any other file is left alone.
+    if socket_path.exists() and not socket_path.is_socket():
+        raise SystemExit(f"--socket path exists and is not a socket: {socket_path}")
+
+
+def query_server(socket_path: Path, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        client.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with client.makefile("rb") as stream:
+            return json.loads(stream.readline() or b"{}")
 
 
 def main() -> int:
     args = parse_args()
+    if args.connect:
+        if args.query is None:
+            raise SystemExit("--query is required with --connect.")
+        if args.stats:
+            raise SystemExit("--stats is not supported with --connect.")
+        request = {"query": args.query, "limit": args.limit, "min_score": args.min_score}
+        if args.fuzzy is not None:
+            request["fuzzy"] = args.fuzzy
+        try:
+            response = query_server(Path(args.connect).expanduser(), request)
+        except (OSError, json.JSONDecodeError) as exc:
+            raise SystemExit(f"Cannot query server at {args.connect}: {exc}")
+        if "error" in response:
+            raise SystemExit(response["error"])
+        write_results((Match(**item) for item in response.get("results", [])), args.format)
+        return 0
+
+    if args.root is None:
+        raise SystemExit("--root is required unless --connect is used.")
     root = Path(args.root).expanduser().resolve()
     if not root.exists() or not root.is_dir():
         raise SystemExit(f"Root path does not exist or is not a directory: {root}")
 
-    terms = query_terms(args.query)
-    if not terms:
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    index_dir = resolve_index_dir(root, args.index_dir)
+    if args.build_index:
+        throughput = Throughput()
+        refresh = build_index(root, index_dir, workers=workers, throughput=throughput, dedup=args.dedup)
+        print(throughput.summary(), file=sys.stderr)
+        mode = "full rebuild" if refresh.full_rebuild else "incremental"
+        aliases = f", {refresh.aliases} near-duplicate aliases" if refresh.dedup else ""
+        carried = "" if refresh.full_rebuild else f", {refresh.carried} documents carried over"
+        print(
+            f"Indexed {refresh.docs} documents ({refresh.terms} terms{aliases}, {mode}: "
+            f"{refresh.added} added, {refresh.changed} changed, {refresh.removed} removed, "
+            f"{refresh.unchanged} unchanged{carried}): {index_dir}"
+        )
+        if args.query is None and args.queries_file is None and not args.serve:
+            return 0
+
+    if args.serve:
+        if args.socket:
+            check_socket_path(Path(args.socket).expanduser())
+        service = QueryService(
+            root,
+            index_dir,
+            workers,
+            use_disk_index=not args.scan,
+            defaults=(args.limit, args.min_score, args.fuzzy or 0),
+        )
+        try:
+            if args.socket:
+                serve_socket(service, Path(args.socket).expanduser())
+            else:
+                serve_stdio(service)
+        finally:
+            service.close()
+        return 0
+
+    if args.queries_file is not None:
+        if args.queries_file == "-":
+            lines = sys.stdin.readlines()
+        else:
+            try:
+                queries_path = Path(args.queries_file).expanduser()
+                lines = queries_path.read_text(encoding="utf-8").splitlines()
+            except (OSError, UnicodeDecodeError) as exc:
+                raise SystemExit(f"Cannot read queries file {args.queries_file}: {exc}")
+        run_queries_file(lines, root, index_dir, args, workers)
+        return 0
+
+    if args.query is None:
+        raise SystemExit(
+            "--query is required unless --queries-file, --build-index, or --serve is used."
+        )
+
+    timings = SearchTimings() if args.stats else None
+    with timed(timings, "parse"):
+        query = parse_query(args.query, args.fuzzy or 0)
+    if not query.terms:
         raise SystemExit("Query must contain at least one searchable term.")
 
-    matches = search(root=root, terms=terms, limit=args.limit, min_score=args.min_score)
-    print_results(matches)
+    with timed(timings, "discover"):
+        signature = None if args.scan else index_signature(index_dir)
+        reader = open_index(index_dir, root) if signature is not None else None
+        mode = "index" if reader is not None else ("mmap" if args.mmap else "scan")
+        cache = None
+        if args.cache_size > 0:
+            if reader is not None:
+                fingerprint = ":".join(map(str, signature))
+            else:
+                fingerprint = dump_fingerprint(root)
+            cache = QueryCache(index_dir / QUERY_CACHE_DIR_NAME, mode, fingerprint, args.cache_size)
+            cache_key = QueryCache.key(query, args.limit, args.min_score)
+            cached = cache.get(cache_key)
+    if cache is not None and cached is not None:
+        if reader is not None:
+            reader.close()
+        matches = write_results(cached, args.format)
+        write_stats(timings, "cache", len(matches), args.format)
+        return 0
+
+    if reader is None and query.fuzzy:
+        throughput = Throughput()
+        with timed(timings, "parse"):
+            reader = build_memory_index(root, workers, throughput)
+        mode = "memory"
+        print(f"No index on disk, built in memory for --fuzzy. {throughput.summary()}", file=sys.stderr)
+    if reader is not None:
+        try:
+            matches = write_results(
+                iter_search_index(reader, query, args.limit, args.min_score, timings), args.format
+            )
+        finally:
+            reader.close()
+    else:
+        throughput = Throughput()
+        matches = write_results(
+            search(
+                root=root,
+                query=query,
+                limit=args.limit,
+                min_score=args.min_score,
+                workers=workers,
+                throughput=throughput,
+                use_mmap=args.mmap,
+                timings=timings,
+            ),
+            args.format,
+        )
+        print(throughput.summary(), file=sys.stderr)
+    if cache is not None:
+        cache.put(cache_key, matches)
+    write_stats(timings, mode, len(matches), args.format)
     return 0
 
 